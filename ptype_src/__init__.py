@@ -1,8 +1,11 @@
 """ PType Module __init__  """
 import sys
 import os
+import argparse
 
 from . import ptype
+from . import bench
+from . import randstream
 from .test import test_backtiles
 from .test import test_plates
 from .test import test_anim
@@ -12,9 +15,26 @@ TEST = None
 #TEST = 'BACKTILES'
 #TEST = 'PLATES'
 
+def parse_args(argv=None):
+    """ Parse command line arguments """
+    parser = argparse.ArgumentParser(prog='ptype_src',
+        description='Vertically scrolling shooter arcade game')
+    parser.add_argument('--bench', metavar='TICKS', type=int, default=0,
+        help='run headless for TICKS ticks and report per-tick time of every phase')
+    parser.add_argument('--seed', type=int, default=None,
+        help='seed of the level generation (same seed = same level)')
+    parser.add_argument('--record', metavar='FILE', default=None,
+        help='record the generated level in FILE')
+    parser.add_argument('--play', metavar='FILE', default=None,
+        help='play the level recorded in FILE instead of generating it')
+    parser.add_argument('--csv', metavar='FILE', default=None,
+        help='write the time of every phase of every frame in FILE (see perfmon.py)')
+    return parser.parse_args(argv)
+
 def _real_main(argv=None):
     """ Real main function, invoke the desired module """
     #print('__init__._real_main()')
+    args = parse_args(argv)
 
     # get the path + filename
     # Example: C:\Users\...\RubikQuat\rubikquat_src\__init__.pyc
@@ -30,7 +50,14 @@ def _real_main(argv=None):
         path = os.path.dirname(path)
         path = os.path.dirname(path)
 
-    if TEST == 'BACKTILES':
+    # seed all random streams, before the level generators are created
+    randstream.STREAMS.seed(args.seed)
+    # the same level again with --seed
+    print('Seed: {}'.format(randstream.STREAMS.seed_value))
+
+    if args.bench > 0:
+        module = bench.Bench(600, 600, path, args.bench)
+    elif TEST == 'BACKTILES':
         module = test_backtiles.TestBacktiles(600, 600, path)
     elif TEST == 'PLATES':
         module = test_plates.TestPlates(600, 600, path)
@@ -38,6 +65,16 @@ def _real_main(argv=None):
         module = test_anim.TestAnim(600, 600, path)
     else:
         module = ptype.PType(600, 600, path)
+
+    # level recording and playing (game and benchmark)
+    game = module.game if args.bench > 0 else module
+    if isinstance(game, ptype.PType):
+        if args.play is not None:
+            game.play_level(args.play)
+        if args.record is not None:
+            game.record_level(args.record)
+        if args.csv is not None:
+            game.perf.open_csv(args.csv)
     module.run()
 
     retcode = 0
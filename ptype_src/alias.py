@@ -0,0 +1,77 @@
+# This file is part of the PType distribution.
+# Copyright (c) 2020 Igor Marinescu (igor.marinescu@gmail.com).
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#-------------------------------------------------------------------------------
+""" Alias Table Module. """
+#-------------------------------------------------------------------------------
+# Alias Table (Walker / Vose alias method):
+# O(1) weighted random choice of one of n items. Every item has a column of
+# height 1 (total height n = sum of the normalized weights * n). The items
+# with a weight above the average fill up the columns of the items below it:
+#
+#   column     |  0  |  1  |  2  |      prob[i]  = part of column i used by item i
+#              +-----+-----+-----+      alias[i] = item in the rest of column i
+#   alias[i]   |  2  |  2  |     |
+#              |.....|     |     |
+#   item i     |  0  |.....|  2  |
+#              |     |  1  |     |
+#              +-----+-----+-----+
+#
+# Choice with one uniform random value rnd in [0, 1):
+#   pos = rnd * n, i = int(pos)
+#   item i if (pos - i) < prob[i], otherwise item alias[i]
+#-------------------------------------------------------------------------------
+
+class AliasTable:
+    """ Alias Table, weighted random choice of items """
+
+    def __init__(self, items, weights):
+        """ items - list of items
+            weights - list of the (float, >= 0) weights of the items """
+        cnt = len(items)
+        self.items = list(items)
+        self.prob = [1.0] * cnt
+        self.alias = list(range(cnt))
+        total = float(sum(weights))
+        if (cnt == 0) or (total <= 0.0):
+            return
+
+        # Vose: distribute the heights above 1 to the columns below 1
+        height = [(weight * cnt) / total for weight in weights]
+        small = [idx for idx, val in enumerate(height) if val < 1.0]
+        large = [idx for idx, val in enumerate(height) if val >= 1.0]
+        while small and large:
+            low = small.pop()
+            high = large.pop()
+            self.prob[low] = height[low]
+            self.alias[low] = high
+            height[high] -= 1.0 - height[low]
+            if height[high] < 1.0:
+                small.append(high)
+            else:
+                large.append(high)
+        # the rest are (rounding errors apart) full columns
+        for idx in small + large:
+            self.prob[idx] = 1.0
+
+    def __len__(self):
+        return len(self.items)
+
+    def choice(self, rnd):
+        """ Return a weighted random item, rnd - uniform random value in [0, 1) """
+        pos = rnd * len(self.items)
+        idx = int(pos)
+        if (pos - idx) >= self.prob[idx]:
+            idx = self.alias[idx]
+        return self.items[idx]
@@ -14,110 +14,343 @@
 # along with this program. If not, see <http://www.gnu.org/licenses/>.
 #-------------------------------------------------------------------------------
 """ Animation Module, contains diverse Animation-Classes. """
+#-------------------------------------------------------------------------------
+# Animation Manager:
+# All animations of a subsystem (ex. Ship, Construct Manager) are stored in an
+# Animation Manager as a struct of arrays and are ticked all at once (tick, one
+# call per cycle for all animations). Every animation is a slot (index) in the
+# parallel arrays:
+#
+#               | slot 0 | slot 1 | slot 2 | ... | count-1 | ... | capacity-1 |
+#   mode        |  CYC   |  TILT  |  LINK  |     |         |     |            |
+#   due         | clock tick of the next frame (NEVER: linked, finished, free) |
+#   ticks_frame |        |        |        |     |         |     |            |
+#   frame_idx   |        |        |        |     |         |     |            |
+#   frame_cnt   |        |        |        |     |         |     |            |
+#   frame_start | offset of the frame list in the frames table                 |
+#   tilt_dir, ini_idx (TILT), link (LINK: slot of the TILT), finish (ONCE)     |
+#               |<------- used slots (active or free) ------>|<-- capacity -->|
+#
+#   frames      | frame list 0 | frame list 1 | ...   (resource indexes, every
+#                                                       frame list stored once)
+#   res_idx of a slot = frames[frame_start + frame_idx]
+#
+# Instead of counting the ticks of every animation, the manager counts the
+# ticks (clock) and every animation has the clock tick of its next frame (due,
+# every ticks_frame + 1 ticks). A tick without any due animation only
+# increments the clock (next_due), otherwise all due animations get their next
+# frame at once:
+#   CYC  - Cyclic-Animation: next frame, after the last frame the first one
+#   ONCE - Once-Animation: next frame, finish after the last frame (the last
+#          frame stays the current one)
+#   TILT - Tilt-Animation: one frame towards tilt_dir (-1 left, 1 right), or
+#          back to the middle frame (tilt_dir 0)
+#   LINK - Tilt-Linked Animation: the frame index of another TILT animation
+#
+# The due animations of a manager with less than VECTOR_MIN used slots (ex. the
+# Ship) are stepped in a loop, the call overhead of NumPy is larger than the
+# work. The due animations of larger managers (ex. many explosions) are stepped
+# all at once, vectorized with NumPy.
+#
+# The Animation Classes (AnimCyc, AnimOnce, AnimTilt, AnimTiltLink) are handles
+# of a slot: they are added to (add) and released from (release) an Animation
+# Manager and read their current frame from it. The frame indexes and resource
+# indexes are also kept as lists (fast read of one value). A released handle
+# has no slot anymore (the slot is reused by the next add), using it raises a
+# RuntimeError. A TILT animation can be released only after its linked ones.
+#-------------------------------------------------------------------------------
+
+import numpy as np
+
+# Animation modes
+MODE_FREE = -1
+MODE_CYC = 0
+MODE_ONCE = 1
+MODE_TILT = 2
+MODE_LINK = 3
+
+ANIM_DTYPE = np.int64
+
+# Due tick of the animations without frames to come
+NEVER = np.iinfo(ANIM_DTYPE).max
+
+# Minimal number of used slots stepped vectorized (less: loop), at 32 slots
+# the loop and the vectorized step take about the same time
+VECTOR_MIN = 32
+
+class AnimationManager:
+    """ Animation Manager, all animations ticked at once """
+
+    def __init__(self, capacity=16):
+        """ Init Animation Manager with an initial capacity (grows if required) """
+        self.count = 0           # used slots (active or free)
+        self.free = []           # released slots, reused by add
+        self.clock = 0           # number of ticks
+        self.next_due = NEVER    # clock tick of the next due animation
+        self.links = {}          # {slot of linked animation: slot of TILT animation}
+        self.mode = np.full(capacity, MODE_FREE, ANIM_DTYPE)
+        self.due = np.full(capacity, NEVER, ANIM_DTYPE)
+        self.ticks_frame = np.zeros(capacity, ANIM_DTYPE)
+        self.frame_idx = np.zeros(capacity, ANIM_DTYPE)
+        self.frame_cnt = np.ones(capacity, ANIM_DTYPE)
+        self.frame_start = np.zeros(capacity, ANIM_DTYPE)
+        self.tilt_dir = np.zeros(capacity, ANIM_DTYPE)
+        self.ini_idx = np.zeros(capacity, ANIM_DTYPE)
+        self.link = np.zeros(capacity, ANIM_DTYPE)
+        self.finish = np.zeros(capacity, bool)
+        self.frames = np.zeros(0, ANIM_DTYPE)
+        self.frames_start = {}   # {tuple(frame list): offset in frames}
+        self.frame_list = []     # frame_idx of every slot (list)
+        self.res_list = []       # res_idx of every slot (list)
+
+    def __len__(self):
+        return self.count - len(self.free)
+
+    def _arrays(self):
+        """ Return all the parallel arrays """
+        return (self.mode, self.due, self.ticks_frame, self.frame_idx, self.frame_cnt,
+                self.frame_start, self.tilt_dir, self.ini_idx, self.link, self.finish)
+
+    def _reserve(self, size):
+        """ Grow arrays (double capacity) until size slots fit in """
+        capacity = len(self.mode)
+        if size <= capacity:
+            return
+        capacity = max(capacity, 1)
+        while capacity < size:
+            capacity *= 2
+        (self.mode, self.due, self.ticks_frame, self.frame_idx, self.frame_cnt,
+         self.frame_start, self.tilt_dir, self.ini_idx, self.link, self.finish) = [
+            np.resize(arr, capacity) for arr in self._arrays()]
+
+    def add_frames(self, frame_lst):
+        """ Return the offset of frame list in the frames table (stored once) """
+        key = tuple(frame_lst)
+        start = self.frames_start.get(key)
+        if start is None:
+            start = len(self.frames)
+            self.frames = np.concatenate([self.frames, np.array(key, ANIM_DTYPE)])
+            self.frames_start[key] = start
+        return start
+
+    def add(self, mode, frame_lst, ticks_frame, frame_idx=0, link=0):
+        """ Add an animation, returns its slot """
+        if self.free:
+            slot = self.free.pop()
+        else:
+            slot = self.count
+            self._reserve(slot + 1)
+            self.count += 1
+            self.frame_list.append(0)
+            self.res_list.append(0)
+        start = self.add_frames(frame_lst)
+        due = NEVER
+        if mode == MODE_LINK:
+            self.links[slot] = link
+        else:
+            due = self.clock + ticks_frame + 1
+            self.next_due = min(self.next_due, due)
+        self.mode[slot] = mode
+        self.due[slot] = due
+        self.ticks_frame[slot] = ticks_frame
+        self.frame_idx[slot] = frame_idx
+        self.frame_cnt[slot] = len(frame_lst)
+        self.frame_start[slot] = start
+        self.tilt_dir[slot] = 0
+        self.ini_idx[slot] = len(frame_lst) // 2
+        self.link[slot] = link
+        self.finish[slot] = False
+        self.frame_list[slot] = frame_idx
+        self.res_list[slot] = int(self.frames[start + frame_idx])
+        return slot
+
+    def release(self, slot):
+        """ Release the slot of an animation (reused by the next add) """
+        if self.mode.item(slot) == MODE_FREE:
+            raise ValueError('Animation slot {} already released'.format(slot))
+        if slot in self.links.values():
+            raise ValueError('Animation slot {} still linked'.format(slot))
+        self.links.pop(slot, None)
+        self.mode[slot] = MODE_FREE
+        self.due[slot] = NEVER
+        self.free.append(slot)
+
+    def tick(self):
+        """ Tick all animations (one cycle) """
+        self.clock += 1
+        if self.clock < self.next_due:
+            return
+        if self.count < VECTOR_MIN:
+            self.step_loop()
+        else:
+            self.step_vector()
+
+    def step_loop(self):
+        """ Next frame of the due animations, one after another """
+        frame_list = self.frame_list
+        dues = self.due[:self.count].tolist()
+        for slot, due in enumerate(dues):
+            if due != self.clock:
+                continue
+            mode = self.mode.item(slot)
+            frame = frame_list[slot]
+            frame_cnt = self.frame_cnt.item(slot)
+            due = self.clock + self.ticks_frame.item(slot) + 1
+            if mode == MODE_TILT:
+                # towards tilt_dir or back to the middle frame
+                tilt_dir = self.tilt_dir.item(slot)
+                if tilt_dir == 0:
+                    ini_idx = self.ini_idx.item(slot)
+                    tilt_dir = (frame < ini_idx) - (frame > ini_idx)
+                frame = min(max(frame + tilt_dir, 0), frame_cnt - 1)
+            else:
+                frame += 1
+                if frame >= frame_cnt:
+                    if mode == MODE_CYC:
+                        frame = 0
+                    else:
+                        self.finish[slot] = True
+                        due = NEVER
+            self.due[slot] = dues[slot] = due
+            self.set_frame(slot, frame)
+        self.next_due = min(dues)
+
+        # linked animations, frame index of the TILT animation
+        for slot, link in self.links.items():
+            self.set_frame(slot, frame_list[link])
+
+    def set_frame(self, slot, frame):
+        """ Set the frame index of slot (arrays and lists) """
+        self.frame_idx[slot] = frame
+        self.frame_list[slot] = frame
+        self.res_list[slot] = self.frames.item(self.frame_start.item(slot) +
+            min(frame, self.frame_cnt.item(slot) - 1))
+
+    def step_vector(self):
+        """ Next frame of the due animations, all at once """
+        cnt = self.count
+        due = self.due[:cnt]
+        idx = np.flatnonzero(due == self.clock)
+        frame_idx = self.frame_idx[:cnt]
+        frame_cnt = self.frame_cnt[:cnt]
+        mode = self.mode[idx]
+        frame = frame_idx[idx] + 1
+        tilt = mode == MODE_TILT
+        if tilt.any():
+            # towards tilt_dir or back to the middle frame
+            t_idx = idx[tilt]
+            t_frame = frame_idx[t_idx]
+            t_dir = self.tilt_dir[t_idx]
+            t_dir = np.where(t_dir != 0, t_dir, np.sign(self.ini_idx[t_idx] - t_frame))
+            frame[tilt] = np.clip(t_frame + t_dir, 0, frame_cnt[t_idx] - 1)
+        f_cnt = frame_cnt[idx]
+        frame[(mode == MODE_CYC) & (frame >= f_cnt)] = 0
+        frame_idx[idx] = frame
+        done = (mode == MODE_ONCE) & (frame >= f_cnt)
+        self.finish[idx[done]] = True
+        due[idx] = np.where(done, NEVER, self.clock + self.ticks_frame[idx] + 1)
+        self.next_due = int(due.min())
+
+        # linked animations, frame index of the TILT animation
+        if self.links:
+            linked = np.flatnonzero(self.mode[:cnt] == MODE_LINK)
+            frame_idx[linked] = frame_idx[self.link[linked]]
+
+        self.frame_list = frame_idx.tolist()
+        self.res_list = self.frames[self.frame_start[:cnt] +
+            np.minimum(frame_idx, frame_cnt - 1)].tolist()
 
 #-------------------------------------------------------------------------------
 class Anim:
-    """ Definition of an Animation """
+    """ Definition of an Animation (handle of a slot in an Animation Manager) """
 
-    def __init__(self, res_man, frame_lst, ticks_frame):
-        """ resMan - resource manager
-            frameLst - list of frames (indexes in resMan)
-            ticksFrame - number of ticks per frame """
+    def __init__(self, res_man, frame_lst, anim_man, slot):
+        """ res_man - resource manager
+            frame_lst - list of frames (indexes in res_man)
+            anim_man - Animation Manager the animation is added to
+            slot - slot of the animation in anim_man """
         self.res_man = res_man
         self.frame_lst = frame_lst
-        self.ticks_frame = ticks_frame
-        self.frame_idx = 0
-        self.ticks_idx = 0
-        # Get resource index of the frame
-        self.res_idx = self.frame_lst[self.frame_idx]
+        self.anim_man = anim_man
+        self.slot = slot         # None after release
+
+    def live_slot(self):
+        """ Return the slot, RuntimeError if the animation was released """
+        if self.slot is None:
+            raise RuntimeError('Animation used after release')
+        return self.slot
+
+    @property
+    def frame_idx(self):
+        """ Index of the current frame in frame_lst """
+        return self.anim_man.frame_list[self.live_slot()]
+
+    @property
+    def res_idx(self):
+        """ Resource index of the current frame """
+        return self.anim_man.res_list[self.live_slot()]
 
     def draw(self, surface, x_pos, y_pos):
         """ Draw current frame on surface """
         self.res_man.draw(surface, self.res_idx, x_pos, y_pos)
 
-    def tick(self):
-        """ Next tick, increment tick index,
-            return True if next frame to be displayed """
-        self.ticks_idx += 1
-        # Next frame to be displayed?
-        if self.ticks_idx > self.ticks_frame:
-            self.ticks_idx = 0
-            return True
-        return False
+    def release(self):
+        """ Release the animation (not ticked anymore) """
+        if self.slot is not None:
+            self.anim_man.release(self.slot)
+            self.slot = None
 
 #-------------------------------------------------------------------------------
 class AnimCyc(Anim):
     """ Definition of Cyclic-Animation """
 
-    def __init__(self, resMan, frameLst, ticksFrame):
+    def __init__(self, resMan, frameLst, ticksFrame, animMan):
         """ resMan - resource manager
             frameLst - list of frames (indexes in resMan)
-            ticksFrame - number of ticks per frame """
-        Anim.__init__(self, resMan, frameLst, ticksFrame)
-
-    def tick(self):
-        if Anim.tick(self):
-            self.frame_idx += 1
-            if self.frame_idx >= len(self.frame_lst):
-                self.frame_idx = 0
-            # Get resource index of the frame
-            self.res_idx = self.frame_lst[self.frame_idx]
+            ticksFrame - number of ticks per frame
+            animMan - Animation Manager """
+        Anim.__init__(self, resMan, frameLst, animMan,
+            animMan.add(MODE_CYC, frameLst, ticksFrame))
 
 #-------------------------------------------------------------------------------
 class AnimOnce(Anim):
     """ Definition of Once-Animation """
 
-    def __init__(self, resMan, frameLst, ticksFrame):
+    def __init__(self, resMan, frameLst, ticksFrame, animMan):
         """ resMan - resource manager
             frameLst - list of frames (indexes in resMan)
-            ticksFrame - number of ticks per frame """
-        Anim.__init__(self, resMan, frameLst, ticksFrame)
-        self.finish = False
+            ticksFrame - number of ticks per frame
+            animMan - Animation Manager """
+        Anim.__init__(self, resMan, frameLst, animMan,
+            animMan.add(MODE_ONCE, frameLst, ticksFrame))
 
-    def tick(self):
-        if not self.finish:
-            if Anim.tick(self):
-                self.frame_idx += 1
-                if self.frame_idx < len(self.frame_lst):
-                    # Get resource index of the frame
-                    self.res_idx = self.frame_lst[self.frame_idx]
-                else:
-                    self.finish = True
+    @property
+    def finish(self):
+        """ True if the animation ended """
+        return bool(self.anim_man.finish[self.live_slot()])
 
 #-------------------------------------------------------------------------------
 class AnimTilt(Anim):
     """ Definition of Tilt-Animation (Tilt to Left or to Right) """
 
-    def __init__(self, resMan, frameLst, ticksFrame):
+    def __init__(self, resMan, frameLst, ticksFrame, animMan):
         """ resMan - resource manager
             frameLst - list of frames (indexes in resMan)
-            ticksFrame - number of ticks per frame """
-        Anim.__init__(self, resMan, frameLst, ticksFrame)
-        self.tilt_dir = 0
+            ticksFrame - number of ticks per frame
+            animMan - Animation Manager """
         # Find the middle frame from the list, this is initial (ini) frame
-        self.ini_idx = len(self.frame_lst)//2
-        self.frame_idx = self.ini_idx
-        # Get resource index of the frame
-        self.res_idx = self.frame_lst[self.frame_idx]
+        self.ini_idx = len(frameLst)//2
+        Anim.__init__(self, resMan, frameLst, animMan,
+            animMan.add(MODE_TILT, frameLst, ticksFrame, self.ini_idx))
 
-    def tick(self):
-        if Anim.tick(self):
-            # if tilt left or right?
-            if self.tilt_dir != 0:
-                self.frame_idx += self.tilt_dir
-                if self.frame_idx < 0:
-                    self.frame_idx = 0
-                elif self.frame_idx >= len(self.frame_lst):
-                    self.frame_idx = len(self.frame_lst) - 1
-            # if no tilt, but we are still not in the middle
-            # move middle frame)
-            elif self.frame_idx != self.ini_idx:
-                if self.frame_idx < self.ini_idx:
-                    self.frame_idx += 1
-                else:
-                    self.frame_idx -= 1
-            # Get resource index of the frame
-            self.res_idx = self.frame_lst[self.frame_idx]
+    @property
+    def tilt_dir(self):
+        """ Tilt direction: -1 = left, 1 = right, 0 = back to the middle frame """
+        return int(self.anim_man.tilt_dir[self.live_slot()])
+
+    @tilt_dir.setter
+    def tilt_dir(self, tilt_dir):
+        self.anim_man.tilt_dir[self.live_slot()] = tilt_dir
 
 #-------------------------------------------------------------------------------
 class AnimTiltLink(Anim):
@@ -127,12 +360,9 @@ class AnimTiltLink(Anim):
     def __init__(self, resMan, frameLst, animTilt):
         """ resMan - resource manager
             frameLst - list of frames (indexes in resMan)
-            animTilt - AnimTilt which handles frame and Tilt """
-        Anim.__init__(self, resMan, frameLst, 0)
+            animTilt - AnimTilt which handles frame and Tilt
+                       (added to the Animation Manager of animTilt) """
         self.anim_tilt = animTilt
-        self.frame_idx = self.anim_tilt.frame_idx
-
-    def tick(self):
-        self.frame_idx = self.anim_tilt.frame_idx
-        self.res_idx = self.frame_lst[self.anim_tilt.frame_idx]
-    
\ No newline at end of file
+        anim_man = animTilt.anim_man
+        Anim.__init__(self, resMan, frameLst, anim_man,
+            anim_man.add(MODE_LINK, frameLst, 0, animTilt.frame_idx, animTilt.live_slot()))
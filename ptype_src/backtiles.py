@@ -25,19 +25,75 @@
 # backTIdx = [ [x=0..TX_CNT], [x=0..TX_CNT] ... [0..TX_CNT] ]
 #
 #   backTIdx[0..TY_CNT][0..TX_CNT]
-#       2D list contains indexes (in ResManager) of background Tiles
-#           Ex: backTImg[y][x] = 2
+#       Tile Map contains indexes (in ResManager) of background Tiles
+#           Ex: backTIdx.get(y, x) = 2
 #               Contains the Tile from ReManager with image index 2
 #
 #   backTImg[0..TY_CNT][0..TX_CNT]
-#       2D list contains pointers to images (in ResManager) of background Tiles
-#               backTImg[y][x] = resMan.imgList[backTIdx[y][x]]
+#       Tile Map contains pointers to images (in ResManager) of background Tiles
+#               backTImg.get(y, x) = resMan.imgList[backTIdx.get(y, x)]
 #
 #   dispTImg[0..TY_CNT][0..TX_CNT]
-#       2D list contains pointers to images (in ResManager) of displayed Tiles
+#       Tile Map contains pointers to images (in ResManager) of displayed Tiles
 #
+#   The Tile Maps (see tilemap.py) store the rows in a ring buffer,
+#   scrolling is done by rotating the head row and not by moving the Tiles.
+#   TX_CNT and TY_CNT are the default sizes, the real sizes are given
+#   at runtime (tx_cnt, ty_cnt).
+#
+# Strip cache:
+#   All Tiles are composited in one tall cached surface (strip), so that
+#   the background is drawn with only one blit. The strip contains the
+#   Back Tiles still to be scrolled in, followed by the Displayed Tiles:
+#
+#    -------+-------------------------------+
+#         0 |  backTImg[TY_CNT - top]       |   ^
+#           |            ...                |   | Back Tiles
+#     top-1 |  backTImg[TY_CNT - 1]         |   v (next to be displayed)
+#    -------+-------------------------------+
+#       top |  dispTImg[0]                  |   ^
+#           |            ...                |   | Displayed Tiles
+#           |  dispTImg[TY_CNT - 1]         |   v
+#    -------+-------------------------------+
+#
+#   where top = TY_CNT - scroll_cnt. Every scroll moves the displayed
+#   window one Tile up in the strip, the strip is composited again only
+#   when the Tiles are generated (generate_back, copy_back_to_disp).
+#
+# Incremental generation:
+#   The next block of Back Tiles (nextTIdx, nextTImg) is generated in
+#   advance, one row every tick (next_step), while the current Back Tiles
+#   are scrolled in. Every generated row is composited in the top half of
+#   the next strip. When all current Back Tiles are scrolled in (scroll_cnt
+#   == TY_CNT) they are exactly the displayed Tiles, so they are composited
+#   (one row every tick, too) in the bottom half of the next strip:
+#
+#    next strip:   0 |  nextTImg[0]              |  generated, row y at step y
+#                      ...
+#           TY_CNT   |  backTImg[0] (scroll_cnt=0) |  displayed after the swap,
+#                      ...                           row y at step y
+#
+#   Then the blocks are swapped (swap_next). If the next block is not
+#   complete yet, the remaining rows are done at once.
+#
+# Block source and sink:
+#   A block of Back Tiles is taken from the block source instead of being
+#   generated randomly, if a block source is set (ex. a recorded level, see
+#   level.py). Every block is passed to the block sink, if one is set:
+#       block_source.next_block() - return the TY_CNT * TX_CNT Tile indexes
+#                                   of the next block (row after row), None if
+#                                   there are no more blocks (the block source
+#                                   is removed, the blocks are random again)
+#       block_sink.add_block(cells) - receive the Tile indexes of a block
+#   Setting a block source restarts the background (start). Setting a block
+#   sink does not: the blocks in use (displayed, scrolled in and the next
+#   one, if complete) are passed to the new sink first.
+#
+
+import pygame
 
-import random
+from . import tilemap
+from . import randstream
 
 TX_CNT = 8
 TY_CNT = 10
@@ -45,17 +101,35 @@ TY_CNT = 10
 class BackTiles:
     """ Background """
 
-    def __init__(self, res_man):
+    def __init__(self, res_man, strip_cache=True, tx_cnt=TX_CNT, ty_cnt=TY_CNT):
+        """ res_man - resource manager containing the background Tiles
+            strip_cache - draw the background from a pre-rendered strip
+            tx_cnt, ty_cnt - number of Tiles on axis X and Y """
 
         self.resman = res_man
+        self.rand = randstream.STREAMS.get('BackTiles')
+        self.tx_cnt = tx_cnt
+        self.ty_cnt = ty_cnt
+
+        self.scroll_cnt = 0
+        self.offset_y = 0
+        self.offset_div = 0
+
+        # Strip cache (created in render_strip)
+        self.strip_cache = strip_cache
+        self.strip = None
 
         # Create Back and Displayed Tiles
-        self.backt_idx = [[0 for x in range(TX_CNT)]    for y in range(TY_CNT)]
-        self.backt_img = [[None for x in range(TX_CNT)] for y in range(TY_CNT)]
-        self.dispt_img = [[None for x in range(TX_CNT)] for y in range(TY_CNT)]
+        self.backt_idx = tilemap.TileMap(ty_cnt, tx_cnt, 0)
+        self.backt_img = tilemap.TileMap(ty_cnt, tx_cnt, None)
+        self.dispt_img = tilemap.TileMap(ty_cnt, tx_cnt, None)
 
-        # Create temp copy list
-        self.back_lastl = [0 for x in range(TX_CNT)]
+        # Next Back Tiles, generated incrementally (see next_step)
+        self.nextt_idx = tilemap.TileMap(ty_cnt, tx_cnt, 0)
+        self.nextt_img = tilemap.TileMap(ty_cnt, tx_cnt, None)
+        self.next_strip = None
+        self.next_gen = None
+        self.next_disp = []      # rows of the Back Tiles images, displayed after the swap
 
         # emptiness & simple stars
         self.bt0 = [0, 0, 1, 4, 13, 15, 22, 26, 27, 31, 48, 49, 50, 51, 52 ,53]
@@ -73,106 +147,224 @@ class BackTiles:
                     [40, 41, 42, 43],
                     [44, 45, 46, 47]]
 
+        # Source and sink of the blocks of Back Tiles (None = random, no sink)
+        self.block_source = None
+        self.block_sink = None
+        self.blocks = []         # Tile indexes of the blocks in use (see set_block_sink)
+
+        self.start()
+
+    def start(self):
+        """ Generate the first Back Tiles (displayed) and the next Back Tiles """
+        self.scroll_cnt = 0
+        self.blocks = []
         self.generate_back()
         self.copy_back_to_disp()
         self.generate_back()
+        self.start_next()
 
-        self.scroll_cnt = 0
-        self.offset_y = 0
-        self.offset_div = 0
+    def set_block_source(self, block_source):
+        """ Set the source of the blocks of Back Tiles (None = random) and restart """
+        self.block_source = block_source
+        self.start()
+
+    def set_block_sink(self, block_sink):
+        """ Set the sink of the blocks of Back Tiles (None = no sink), the blocks in use
+            are passed to it first (the background is not restarted) """
+        self.block_sink = block_sink
+        if block_sink is not None:
+            for cells in self.blocks:
+                block_sink.add_block(cells)
 
     def generate_back(self):
-        """ Generate new Back Tiles backTIdx and backTImg """
+        """ Generate new Back Tiles backTIdx and backTImg (all rows at once) """
+        for _ in self.gen_back(self.backt_idx, self.backt_img):
+            pass
+
+        self.render_strip()
+
+    def gen_back(self, back_idx, back_img):
+        """ Generator, generates new Back Tiles in the Tile Maps back_idx and back_img
+            (or takes them from the block source).
+            Every step generates one row, yields the index of the generated row """
+        cells = None
+        if self.block_source is not None:
+            cells = self.block_source.next_block()
+            if cells is None:
+                # no more blocks, random from now on
+                self.block_source = None
+        if cells is not None:
+            back_idx.fill(0)
+            back_idx.cells[:] = cells
+            rows = range(self.ty_cnt)
+        else:
+            rows = self.gen_back_idx(back_idx)
+
+        # copy from idx to image
+        img_list = self.resman.img_list
+        back_img.head = back_idx.head
+        for y_pos in rows:
+            back_img.set_row(y_pos, [img_list[idx] for idx in back_idx.get_row(y_pos)])
+            yield y_pos
+
+        # fill() reset the head, the flat cells are in row order
+        cells = list(back_idx.cells)
+        self.blocks.append(cells)
+        if self.block_sink is not None:
+            self.block_sink.add_block(cells)
+
+    def gen_back_idx(self, back_idx):
+        """ Generator, generates new random Back Tiles indexes in the Tile Map back_idx.
+            Every step generates one row, yields the index of the generated row """
+        tx_cnt = self.tx_cnt
+        ty_cnt = self.ty_cnt
 
         # clear old pattern
-        for y_pos in range(TY_CNT):
-            for x_pos in range(TX_CNT):
-                self.backt_idx[y_pos][x_pos] = 0
+        back_idx.fill(0)
 
         # place 1 very big (2x2) asteroid
-        x_pos = random.randint(-1, TX_CNT - 1)
-        y_pos = random.randint(0, TY_CNT - 2)
-        z_idx = random.randint(0, len(self.bt4) - 1)
+        x_pos = self.rand.randint(-1, tx_cnt - 1)
+        y_pos = self.rand.randint(0, ty_cnt - 2)
+        z_idx = self.rand.randint(0, len(self.bt4) - 1)
         if x_pos >= 0:
-            self.backt_idx[y_pos    ][x_pos] = self.bt4[z_idx][0]
-            self.backt_idx[y_pos + 1][x_pos] = self.bt4[z_idx][2]
-        if (x_pos + 1) < TX_CNT:
-            self.backt_idx[y_pos    ][x_pos + 1] = self.bt4[z_idx][1]
-            self.backt_idx[y_pos + 1][x_pos + 1] = self.bt4[z_idx][3]
+            back_idx.set(y_pos    , x_pos, self.bt4[z_idx][0])
+            back_idx.set(y_pos + 1, x_pos, self.bt4[z_idx][2])
+        if (x_pos + 1) < tx_cnt:
+            back_idx.set(y_pos    , x_pos + 1, self.bt4[z_idx][1])
+            back_idx.set(y_pos + 1, x_pos + 1, self.bt4[z_idx][3])
 
         # place 1 commet (2x1)
-        x_pos = random.randint(0, TX_CNT - 2)
-        y_pos = random.randint(0, TY_CNT - 2)
-        z_idx = random.randint(0, len(self.bt3) - 1)
-        if (self.backt_idx[y_pos][x_pos] == 0) and (self.backt_idx[y_pos][x_pos + 1] == 0):
-            self.backt_idx[y_pos][x_pos]     = self.bt3[z_idx][0]
-            self.backt_idx[y_pos][x_pos + 1] = self.bt3[z_idx][1]
+        x_pos = self.rand.randint(0, tx_cnt - 2)
+        y_pos = self.rand.randint(0, ty_cnt - 2)
+        z_idx = self.rand.randint(0, len(self.bt3) - 1)
+        if (back_idx.get(y_pos, x_pos) == 0) and (back_idx.get(y_pos, x_pos + 1) == 0):
+            back_idx.set(y_pos, x_pos,     self.bt3[z_idx][0])
+            back_idx.set(y_pos, x_pos + 1, self.bt3[z_idx][1])
 
         # place 3 big asteroid
         for _ in range(3):
-            x_pos = random.randint(0, TX_CNT - 1)
-            y_pos = random.randint(0, TY_CNT - 1)
-            z_idx = random.randint(0, len(self.bt2) - 1)
-            if self.backt_idx[y_pos][x_pos] == 0:
-                self.backt_idx[y_pos][x_pos] = self.bt2[z_idx]
+            x_pos = self.rand.randint(0, tx_cnt - 1)
+            y_pos = self.rand.randint(0, ty_cnt - 1)
+            z_idx = self.rand.randint(0, len(self.bt2) - 1)
+            if back_idx.get(y_pos, x_pos) == 0:
+                back_idx.set(y_pos, x_pos, self.bt2[z_idx])
 
         # place 6 small asteroid
         for _ in range(6):
-            x_pos = random.randint(0, TX_CNT - 1)
-            y_pos = random.randint(0, TY_CNT - 1)
-            z_idx = random.randint(0, len(self.bt1) - 1)
-            if self.backt_idx[y_pos][x_pos] == 0:
-                self.backt_idx[y_pos][x_pos] = self.bt1[z_idx]
-
-        # fill the rest with small stars and empyness
-        for y_pos in range(0, TY_CNT):
-            for x_pos in range(0, TX_CNT):
-                if self.backt_idx[y_pos][x_pos] == 0:
-                    self.backt_idx[y_pos][x_pos] = self.bt0[random.randint(0, len(self.bt0) - 1)]
+            x_pos = self.rand.randint(0, tx_cnt - 1)
+            y_pos = self.rand.randint(0, ty_cnt - 1)
+            z_idx = self.rand.randint(0, len(self.bt1) - 1)
+            if back_idx.get(y_pos, x_pos) == 0:
+                back_idx.set(y_pos, x_pos, self.bt1[z_idx])
 
-        # copy from idx to image
-        for y_pos in range(TY_CNT):
-            for x_pos in range(TX_CNT):
-                self.backt_img[y_pos][x_pos] = self.resman.img_list[self.backt_idx[y_pos][x_pos]]
+        # fill the rest with small stars and empyness, row by row
+        for y_pos in range(ty_cnt):
+            row = back_idx.get_row(y_pos)
+            for x_pos, val in enumerate(row):
+                if val == 0:
+                    row[x_pos] = self.bt0[self.rand.randint(0, len(self.bt0) - 1)]
+            back_idx.set_row(y_pos, row)
+            yield y_pos
+
+    def start_next(self):
+        """ Start the incremental generation of the next Back Tiles """
+        self.next_gen = self.gen_back(self.nextt_idx, self.nextt_img)
+        if self.strip_cache:
+            self.next_strip = pygame.Surface((self.tx_cnt * 64, 2 * self.ty_cnt * 64))
+            self.next_disp = [self.backt_img.get_row(y_pos) for y_pos in range(self.ty_cnt)]
+
+    def next_step(self):
+        """ Generate (and composite) one row of the next Back Tiles.
+            Returns False if the next Back Tiles are complete """
+        if self.next_gen is None:
+            return False
+        try:
+            y_pos = next(self.next_gen)
+        except StopIteration:
+            self.next_gen = None
+            return False
+        if self.next_strip is not None:
+            for x_pos, img in enumerate(self.nextt_img.get_row(y_pos)):
+                self.next_strip.blit(img, (x_pos * 64, y_pos * 64))
+            for x_pos, img in enumerate(self.next_disp[y_pos]):
+                self.next_strip.blit(img, (x_pos * 64, (self.ty_cnt + y_pos) * 64))
+        return True
+
+    def swap_next(self):
+        """ All Back Tiles scrolled in, the next Back Tiles become the Back Tiles """
+        # complete the next Back Tiles, if not ready yet
+        while self.next_step():
+            pass
+        self.backt_idx, self.nextt_idx = self.nextt_idx, self.backt_idx
+        self.backt_img, self.nextt_img = self.nextt_img, self.backt_img
+        # the displayed block is scrolled out
+        del self.blocks[0]
+
+        # black is transparent, RLE encoded once at the first display
+        if self.next_strip is not None:
+            self.next_strip.set_colorkey((0, 0, 0), pygame.RLEACCEL)
+            self.strip = self.next_strip
+
+        self.start_next()
 
     def copy_back_to_disp(self):
         """ Copy all Back Tiles --> Display Tiles """
-        for y_pos in range(0, TY_CNT):
-            for x_pos in range(0, TX_CNT):
-                self.dispt_img[y_pos][x_pos] = self.backt_img[y_pos][x_pos]
+        self.dispt_img.head = self.backt_img.head
+        self.dispt_img.cells[:] = self.backt_img.cells
+
+        self.render_strip()
+
+    def render_strip(self):
+        """ Composite Back Tiles (still to be scrolled in) and Display Tiles in the strip """
+        if not self.strip_cache:
+            return
+        # Composite in a new strip (2 x ty_cnt Tiles high, black): blitting on
+        # a RLE surface decodes and encodes it again for every blit
+        strip = pygame.Surface((self.tx_cnt * 64, 2 * self.ty_cnt * 64))
+        top = self.ty_cnt - self.scroll_cnt
+        for y_pos in range(top):
+            for x_pos, img in enumerate(self.backt_img.get_row(self.ty_cnt - top + y_pos)):
+                if img is not None:
+                    strip.blit(img, (x_pos * 64, y_pos * 64))
+        for y_pos in range(self.ty_cnt):
+            for x_pos, img in enumerate(self.dispt_img.get_row(y_pos)):
+                if img is not None:
+                    strip.blit(img, (x_pos * 64, (top + y_pos) * 64))
+        # black is transparent, RLE encoded once at the first display
+        strip.set_colorkey((0, 0, 0), pygame.RLEACCEL)
+        self.strip = strip
 
     def scroll(self):
         """ Scroll Back and Displayed Tiles with 1 Tile down """
 
-        # copy last line from backTiles to temp buffer
-        for x_pos in range(TX_CNT):
-            self.back_lastl[x_pos] = self.backt_img[TY_CNT - 1][x_pos]
-
-        # scroll down both: display and backTiles
-        for y_pos in range(TY_CNT - 1, 0, -1):
-            for x_pos in range(TX_CNT):
-                self.dispt_img[y_pos][x_pos] = self.dispt_img[y_pos - 1][x_pos]
-                self.backt_img[y_pos][x_pos] = self.backt_img[y_pos - 1][x_pos]
+        # scroll down display, copy last line from backTiles at the top of display
+        self.dispt_img.scroll()
+        self.dispt_img.set_row(0, self.backt_img.get_row(self.ty_cnt - 1))
 
-        # copy last line from backTiles at the top of display
-        for x_pos in range(TX_CNT):
-            self.dispt_img[0][x_pos] = self.back_lastl[x_pos]
+        # scroll down backTiles
+        self.backt_idx.scroll()
+        self.backt_img.scroll()
 
         # backTiles buffer empty? generate new
         self.scroll_cnt += 1
-        if self.scroll_cnt >= TY_CNT:
-            self.generate_back()
+        if self.scroll_cnt >= self.ty_cnt:
             self.scroll_cnt = 0
+            self.swap_next()
 
     def display(self, surface):
         """ Draw all Display Tiles """
-        for y_pos in range(TY_CNT):
-            for x_pos in range(TX_CNT):
-                surface.blit(self.dispt_img[y_pos][x_pos], ((x_pos * 64),
-                    self.offset_y + (y_pos * 64) - 64))
+        if self.strip is not None:
+            top = self.ty_cnt - self.scroll_cnt
+            surface.blit(self.strip, (0, self.offset_y - 64),
+                (0, top * 64, self.tx_cnt * 64, self.ty_cnt * 64))
+            return
+        for y_pos in range(self.ty_cnt):
+            for x_pos, img in enumerate(self.dispt_img.get_row(y_pos)):
+                surface.blit(img, ((x_pos * 64), self.offset_y + (y_pos * 64) - 64))
 
     def tick(self):
         """ Class Tick function, must be called every cycle """
+        self.next_step()
         self.offset_div += 1
         if self.offset_div > 4:
             self.offset_div = 0
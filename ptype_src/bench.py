@@ -0,0 +1,137 @@
+# This file is part of the PType distribution.
+# Copyright (c) 2020 Igor Marinescu (igor.marinescu@gmail.com).
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#-------------------------------------------------------------------------------
+""" Benchmark Module.
+
+Runs PType headless (SDL dummy video driver), without the clock.tick(60)
+throttle and with a scripted input instead of the keyboard.
+A fixed number of ticks is executed as fast as possible and the time spent
+in every phase of the frame (measured by the Frame Timer of the game, see
+perfmon.py: input, update phases, display layers, presenting) is reported
+per tick.
+
+Execute with:
+$ python -m ptype_src --bench 2000
+"""
+
+import os
+import time
+
+import pygame
+
+from . import ptype
+
+# Scripted ship control: list of (ticks, control) executed cyclically
+# control is the bitmask returned by PType.get_control (1=Left, 2=Right, 4=Up, 8=Down)
+CONTROL_SCRIPT = [ # (ticks, control)
+                    (60, 1),
+                    (20, 0),
+                    (60, 2),
+                    (20, 0),
+                    (30, 4),
+                    (30, 8),
+                ]
+
+# Scripted key presses: list of (tick, key), executed once at the given tick
+KEY_SCRIPT = [ # (tick, key)
+                (0, pygame.K_3),     # both side weapons
+            ]
+
+# Shoot every SHOOT_TICKS ticks
+SHOOT_TICKS = 8
+
+class ScriptedInput:
+    """ Scripted input, replaces the keyboard """
+
+    def __init__(self, control_script=None, key_script=None, shoot_ticks=SHOOT_TICKS):
+        """ control_script - list of (ticks, control), repeated cyclically
+            key_script - list of (tick, key), pressed once at tick
+            shoot_ticks - press K_q every shoot_ticks ticks (0 = never) """
+        self.control_script = control_script if control_script is not None else CONTROL_SCRIPT
+        self.key_script = key_script if key_script is not None else KEY_SCRIPT
+        self.shoot_ticks = shoot_ticks
+        self.period = sum(ticks for ticks, _ in self.control_script)
+
+    def get_keys(self, tick):
+        """ Return the list of keys pressed at tick """
+        keys = [key for key_tick, key in self.key_script if key_tick == tick]
+        if (self.shoot_ticks > 0) and ((tick % self.shoot_ticks) == 0):
+            keys.append(pygame.K_q)
+        return keys
+
+    def get_control(self, tick):
+        """ Return the ship control bitmask at tick """
+        pos = tick % self.period
+        for ticks, control in self.control_script:
+            if pos < ticks:
+                return control
+            pos -= ticks
+        return 0
+
+class Bench:
+    """ Headless fixed-step benchmark runner """
+
+    def __init__(self, width, height, path, ticks):
+        """ Init benchmark, the PType instance is created on the dummy video driver """
+        # Must be set before the display is initialized
+        os.environ['SDL_VIDEODRIVER'] = 'dummy'
+        self.game = ptype.PType(width, height, path)
+        self.ticks = ticks
+        self.script = ScriptedInput()
+        self.frame_times = []    # phase times of every tick (see perfmon.FrameTimer)
+        self.total_time = 0.0
+
+    def run(self):
+        """ Execute all ticks as fast as possible, then print the report """
+        self.run_ticks()
+        self.game.close()
+        self.report()
+
+    def run_ticks(self):
+        """ Execute all ticks as fast as possible (the game is not closed) """
+        game = self.game
+        perf = game.perf
+        start = time.perf_counter()
+        for tick in range(self.ticks):
+            perf.start_frame()
+            for key in self.script.get_keys(tick):
+                game.handle_key(key)
+            control = self.script.get_control(tick)
+            perf.lap('input')
+            game.update(control)
+            game.display()
+            game.present()
+            perf.end_frame()
+            self.frame_times.append(perf.current)
+            pygame.event.pump()
+        self.total_time = time.perf_counter() - start
+
+    def report(self):
+        """ Print per-tick time of every phase """
+        self.game.load_report.print()
+        print('Ticks: {}  Total: {:.3f}s  Ticks/s: {:.1f}'.format(
+            self.ticks, self.total_time, self.ticks / max(self.total_time, 1e-9)))
+        print('{:<28}{:>10}{:>10}{:>10}{:>8}'.format('Phase', 'mean[us]', 'min[us]',
+            'max[us]', '%'))
+        phases = self.game.perf.phases
+        for idx in list(range(1, len(phases))) + [0]:
+            samples = [times[idx] for times in self.frame_times if len(times) > idx]
+            if not samples:
+                continue
+            name = phases[idx]
+            total = sum(samples)
+            print('{:<28}{:>10.1f}{:>10.1f}{:>10.1f}{:>8.1f}'.format(name,
+                total * 1e6 / len(samples), min(samples) * 1e6, max(samples) * 1e6,
+                total * 100.0 / max(self.total_time, 1e-9)))
@@ -0,0 +1,241 @@
+# This file is part of the PType distribution.
+# Copyright (c) 2020 Igor Marinescu (igor.marinescu@gmail.com).
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#-------------------------------------------------------------------------------
+""" Asset Bundle Module.
+
+All texture images are sliced offline (build) into tiles, the raw pixel data
+of all tiles is written in one packed file (bundle) together with an index.
+At runtime the bundle is memory-mapped and every tile is a surface created
+with pygame.image.frombuffer directly on the mapped pixel data: no PNG
+decoding, no conversion and no slicing. The bundle is only used if it is up
+to date: every entry stores the SHA1 hash of its texture image and of its
+slicing parameters, if any of them changed the images are decoded (warning).
+
+Build the bundle with:
+$ python -m ptype_src.bundle
+"""
+#-------------------------------------------------------------------------------
+# Bundle file:
+#
+#   +--------+---------+-----------+-------------+---------+-------------+----
+#   | magic  | version | index_len | index       | padding | tile 0 data | ...
+#   | 8 byte | uint32  | uint32    | JSON (utf8) |         | w * h * 4   |
+#   +--------+---------+-----------+-------------+---------+-------------+----
+#
+#   index = { "pixel_format": "BGRA",
+#             "entries": { name: { "colorkey": [r, g, b],
+#                                  "tiles": [[offset, w, h], ...],  (offset from data start)
+#                                  "plates_def": [[U, R, B, L, Sum], ...] or null,
+#                                  "source": SHA1 of the texture image,
+#                                  "slicing": SHA1 of the slicing parameters },
+#                          ... } }
+#
+# The pixel data is stored as BGRA (byte order of the usual XRGB8888 display
+# format), every tile is 4-byte aligned. The alpha byte is ignored at runtime,
+# transparency is given by the colorkey.
+#-------------------------------------------------------------------------------
+
+import os
+import sys
+import json
+import hashlib
+import mmap
+import struct
+import argparse
+
+import pygame
+
+from . import resman
+from . import platesman
+from . import res_def_backtiles
+from . import res_def_ship
+from . import res_def_constrman
+
+BUNDLE_MAGIC = b'PTYPEBND'
+BUNDLE_VERSION = 2
+BUNDLE_HEADER = '<8sII'
+PIXEL_FORMAT = 'BGRA'
+
+# Default bundle file (relative to the package path)
+BUNDLE_FILE = '/resources/assets.bundle'
+
+# Bundle definitions
+# name = name of the entry in the bundle
+# filename = texture image (relative to the package path)
+# res_def = resource definition of the tiles, None for Plates (see platesman.decode_plates)
+# colorkey, colorkeypos = as for ResourceManager.load_tiles
+BUNDLE_DEF = [ # (name, filename, res_def, colorkey, colorkeypos)
+                ('stars', '/resources/stars.png', res_def_backtiles.resDef, None, None),
+                ('images', '/resources/images.png', res_def_ship.resDefShip, -1, None),
+                ('construct', '/resources/construct.png', res_def_constrman.resDef, -1, None),
+                ('plates64x64', '/resources/plates64x64.png', None, None, (0, 0)),
+            ]
+
+def source_digest(fullname):
+    """ Return the SHA1 hash of the texture image fullname """
+    with open(fullname, 'rb') as file:
+        return hashlib.sha1(file.read()).hexdigest()
+
+def slicing_digest(res_def, colorkey, colorkeypos):
+    """ Return the SHA1 hash of the slicing parameters of an entry (the Plates
+        detection parameters for Plates) """
+    if res_def is None:
+        res_def = [platesman.PLATE_SIZE, platesman.EDGE_SEGMENTS, platesman.EDGE_INSET]
+    params = json.dumps([res_def, colorkey, colorkeypos])
+    return hashlib.sha1(params.encode('utf-8')).hexdigest()
+
+def build_bundle(path, out_file, bundle_def=None):
+    """ Slice all texture images of bundle_def and write the bundle file.
+        The display must be initialized (conversion to display format). """
+    if bundle_def is None:
+        bundle_def = BUNDLE_DEF
+    entries = {}
+    blobs = []
+    offset = 0
+    for name, filename, res_def, colorkey, colorkeypos in bundle_def:
+        plates_def = None
+        if res_def is None:
+            tiles, plates_def = platesman.decode_plates(path + filename)
+            plates_def = [list(plate) for plate in plates_def]
+        else:
+            tiles = resman.slice_tiles(path + filename, res_def, colorkey, colorkeypos)
+        tiles_idx = []
+        for tile in tiles:
+            data = pygame.image.tostring(tile, PIXEL_FORMAT)
+            tiles_idx.append([offset, tile.get_width(), tile.get_height()])
+            blobs.append(data)
+            offset += len(data)
+        # All tiles are copies with black (0, 0, 0) as colorkey
+        entries[name] = {'colorkey': [0, 0, 0], 'tiles': tiles_idx, 'plates_def': plates_def,
+                         'source': source_digest(path + filename),
+                         'slicing': slicing_digest(res_def, colorkey, colorkeypos)}
+
+    index = json.dumps({'pixel_format': PIXEL_FORMAT, 'entries': entries}).encode('utf-8')
+    data_start = struct.calcsize(BUNDLE_HEADER) + len(index)
+    data_start = (data_start + 15) & ~15
+    with open(out_file, 'wb') as file:
+        file.write(struct.pack(BUNDLE_HEADER, BUNDLE_MAGIC, BUNDLE_VERSION, len(index)))
+        file.write(index)
+        file.write(bytes(data_start - file.tell()))
+        for blob in blobs:
+            file.write(blob)
+    return data_start + offset
+
+class Bundle:
+    """ Memory-mapped Asset Bundle """
+
+    def __init__(self, filename):
+        """ Open and memory-map the bundle file """
+        self.filename = filename
+        with open(filename, 'rb') as file:
+            # copy-on-write mapping, SDL gets a writable pixel buffer
+            self.mmap = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_COPY)
+        self.view = memoryview(self.mmap)
+        magic, version, index_len = struct.unpack_from(BUNDLE_HEADER, self.mmap, 0)
+        if (magic != BUNDLE_MAGIC) or (version != BUNDLE_VERSION):
+            raise ValueError('Not a PType bundle (version {}): {}'.format(BUNDLE_VERSION,
+                filename))
+        start = struct.calcsize(BUNDLE_HEADER)
+        index = json.loads(bytes(self.view[start:start + index_len]).decode('utf-8'))
+        self.data_start = (start + index_len + 15) & ~15
+        self.pixel_format = index['pixel_format']
+        self.entries = index['entries']
+        self.tiles_cache = {}
+
+    def tiles(self, name):
+        """ Return the list of tiles (surfaces on the mapped pixel data) of entry name """
+        tiles = self.tiles_cache.get(name)
+        if tiles is None:
+            entry = self.entries[name]
+            colorkey = entry['colorkey']
+            tiles = []
+            for offset, width, height in entry['tiles']:
+                start = self.data_start + offset
+                surf = pygame.image.frombuffer(self.view[start:start + (width * height * 4)],
+                    (width, height), self.pixel_format)
+                # ignore the alpha byte, transparency is given by the colorkey
+                surf.set_alpha(None)
+                surf.set_colorkey(colorkey)
+                tiles.append(surf)
+            self.tiles_cache[name] = tiles
+        return tiles
+
+    def plates_def(self, name):
+        """ Return the Plates definitions of entry name (None if not Plates) """
+        plates_def = self.entries[name]['plates_def']
+        if plates_def is None:
+            return None
+        return [tuple(plate) for plate in plates_def]
+
+    def stale_entries(self, path, bundle_def=None):
+        """ Return the names of the entries of bundle_def missing in the bundle or
+            built from another texture image or with other slicing parameters """
+        if bundle_def is None:
+            bundle_def = BUNDLE_DEF
+        stale = []
+        for name, filename, res_def, colorkey, colorkeypos in bundle_def:
+            entry = self.entries.get(name)
+            if (entry is None) or \
+                    (entry['slicing'] != slicing_digest(res_def, colorkey, colorkeypos)) or \
+                    (entry['source'] != source_digest(path + filename)):
+                stale.append(name)
+        return stale
+
+def open_bundle(filename):
+    """ Open bundle through the asset cache (one mapping per file, a file built
+        again is mapped again). Returns (key, bundle), release with
+        resman.ASSET_CACHE.release(key) """
+    stat = os.stat(filename)
+    key = ('bundle', os.path.normpath(filename), stat.st_mtime_ns, stat.st_size)
+    return key, resman.ASSET_CACHE.acquire(key, lambda: Bundle(filename))
+
+def open_valid_bundle(path, filename=None, bundle_def=None):
+    """ Open the bundle (path + BUNDLE_FILE) if it exists and is up to date with the
+        texture images, otherwise print a warning (out of date).
+        Returns (key, bundle), (None, None) if the images must be decoded """
+    if filename is None:
+        filename = path + BUNDLE_FILE
+    if not os.path.exists(filename):
+        return None, None
+    try:
+        key, bundle = open_bundle(filename)
+    except ValueError as err:
+        print('Warning: {}, images decoded (build it again)'.format(err), file=sys.stderr)
+        return None, None
+    stale = bundle.stale_entries(path, bundle_def)
+    if stale:
+        resman.ASSET_CACHE.release(key)
+        print('Warning: bundle {} out of date ({}), images decoded (build it again)'.format(
+            filename, ', '.join(stale)), file=sys.stderr)
+        return None, None
+    return key, bundle
+
+def main(argv=None):
+    """ Build the bundle """
+    path = os.path.dirname(os.path.realpath(os.path.abspath(__file__)))
+    parser = argparse.ArgumentParser(prog='ptype_src.bundle',
+        description='Build the PType asset bundle')
+    parser.add_argument('--out', default=path + BUNDLE_FILE, help='bundle file')
+    args = parser.parse_args(argv)
+
+    # conversion to display format, no window required
+    os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+    pygame.display.set_mode((1, 1))
+    size = build_bundle(path, args.out)
+    print('Bundle written: {} ({} bytes)'.format(args.out, size))
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -15,10 +15,11 @@
 #-------------------------------------------------------------------------------
 
 """ Constructions (Buildings) Module. """
-import random
+import numpy as np
 
 from . import anim
 from . import resman
+from . import randstream
 from . import res_def_constrman
 
 TY_OUT = 11
@@ -68,10 +69,18 @@ class Constr:
 
     def draw(self, surface):
         """ draw construct (whole or destroyed) """
+        self.draw_static(surface, self.y_pos - 64)
+        self.draw_anim(surface)
+
+    def draw_static(self, surface, y_pos):
+        """ draw the static image of the construct (whole or destroyed) """
         if self.life > 0:
-            surface.blit(self.img0, (self.x_pos, self.y_pos - 64))
+            surface.blit(self.img0, (self.x_pos, y_pos))
         else:
-            surface.blit(self.img1, (self.x_pos, self.y_pos - 64))
+            surface.blit(self.img1, (self.x_pos, y_pos))
+
+    def draw_anim(self, surface):
+        """ draw explosion and hit animations of the construct """
         # draw explosion animation if required
         if self.exp_anim is not None:
             self.exp_anim.draw(surface, self.x_pos, self.y_pos - 64)
@@ -82,49 +91,81 @@ class Constr:
     def tick(self, offset_y):
         """ Construct tick, to be called every cycle """
         self.y_pos = (self.row * 64) + offset_y
-        # construct explosion animation tick
+        # construct explosion animation (ticked by the Animation Manager)
         if self.exp_anim is not None:
-            self.exp_anim.tick()
             # If animation ended, destroy it
             if self.exp_anim.finish:
+                self.exp_anim.release()
                 self.exp_anim = None
-        # construct hit animation tick
+        # construct hit animation (ticked by the Animation Manager)
         if self.hit_anim is not None:
-            self.hit_anim.tick()
             # If animation ended, destroy it
             if self.hit_anim.finish:
+                self.hit_anim.release()
                 self.hit_anim = None
 
-    def check_hit(self, shot):
-        """ Check if the construct is hit """
+    def release(self):
+        """ Release the animations of the construct (construct removed) """
+        for anim_obj in (self.exp_anim, self.hit_anim):
+            if anim_obj is not None:
+                anim_obj.release()
+        self.exp_anim = None
+        self.hit_anim = None
+
+    def check_hit(self, x_pos, y_pos):
+        """ Check if the construct is hit by the shot at (x_pos, y_pos) """
         if self.life > 0:
-            if (shot.y_pos >= (self.y_pos - 64)) and (shot.y_pos <= self.y_pos):
-                if (shot.x_pos >= self.x_pos) and (shot.x_pos <= (self.x_pos + 64)):
+            if (y_pos >= (self.y_pos - 64)) and (y_pos <= self.y_pos):
+                if (x_pos >= self.x_pos) and (x_pos <= (self.x_pos + 64)):
                     # reduce the life of construct
                     self.life -= 25
-                    # create hit animation
+                    # create hit animation (the previous one is replaced)
+                    if self.hit_anim is not None:
+                        self.hit_anim.release()
                     self.hit_anim = self.master.get_hit_anim()
-                    self.hit_x = shot.x_pos
+                    self.hit_x = x_pos
                     # if destroyed, create explosion animatoin
                     if self.life <= 0:
                         self.exp_anim = self.master.get_exp_anim(self.exp_idx)
+                        # the static image changed (destroyed building)
+                        self.master.static_rows.add(self.row)
                     return True
         return False
 
 class ConstrManager:
     """ Constructs Manager """
 
-    def __init__(self, path, shot_list):
-        """ Init Constructs Manager """
+    def __init__(self, path, shot_pool, tx_out=TX_OUT, ty_out=TY_OUT):
+        """ Init Constructs Manager
+            tx_out, ty_out - number of displayed Plates on axis X and Y """
         self.path = path
+        self.rand = randstream.STREAMS.get('ConstrManager')
+        self.tx_out = tx_out
+        self.ty_out = ty_out
         self.constr_def = []     # Constructs definitions
         self.constr_dsp = []     # Constructs currently displayed
-        self.shot_list = shot_list
-        self.resman = resman.ResourceManager(path)
+        # Grid index of displayed constructs: constr_grid[row][col] = index in constr_dsp
+        # (-1 = no construct), the last row is always empty (shots below the last row)
+        self.constr_grid = np.full((ty_out + 1, tx_out), -1, np.int32)
+        self.offset_y = 0        # Current plates offset (see tick)
+        self.static_rows = set() # Rows with static images changed since last draw_static
+        self.shot_pool = shot_pool
+        self.resman = resman.ResourceManager(path, subsurface=True)
+        # all animations (explosion, hit) of the constructs, ticked at once (see tick)
+        self.anims = anim.AnimationManager()
 
     def load_constr(self, filename):
         """ Load all construct resources from image file """
         self.resman.load_tiles(filename, res_def_constrman.resDef, colorkey=-1)
+        self.add_constr_def()
+
+    def load_constr_bundle(self, bundle, name):
+        """ Load all construct resources of entry name from an asset bundle """
+        self.resman.load_bundle_tiles(bundle, name)
+        self.add_constr_def()
+
+    def add_constr_def(self):
+        """ Create the Construct definitions from the loaded resources """
         for c_def in CONSTR_DEF:
             # Construct definition object (img0, img1, expIdx, life)
             c_def_obj = (self.resman.img_list[c_def[0]], self.resman.img_list[c_def[1]], \
@@ -134,47 +175,122 @@ class ConstrManager:
     def get_exp_anim(self, exp_idx):
         """ Create and get explosion animation for the construct """
         anim_def = ANIM_DEF[exp_idx]
-        return anim.AnimOnce(self.resman, anim_def[0], anim_def[1])
+        return anim.AnimOnce(self.resman, anim_def[0], anim_def[1], self.anims)
 
     def get_hit_anim(self):
         """ Create and get hit animation for the construct """
-        return anim.AnimOnce(self.resman, ANIM_DEF[0][0], ANIM_DEF[0][1])
+        return anim.AnimOnce(self.resman, ANIM_DEF[0][0], ANIM_DEF[0][1], self.anims)
 
     def draw(self, surface):
         """ Draw all constructs """
         for constr in self.constr_dsp:
             constr.draw(surface)
 
+    def draw_static(self, surface, rows=None):
+        """ Draw the static images of all constructs on the (cached) plates layer,
+            construct in row r is drawn at y = r * 64
+            rows - draw only the constructs in these rows (None = all rows) """
+        for constr in self.constr_dsp:
+            if (rows is None) or (constr.row in rows):
+                constr.draw_static(surface, constr.row * 64)
+        self.static_rows = set()
+
+    def draw_anim(self, surface):
+        """ Draw the animations (explosion, hit) of all constructs """
+        for constr in self.constr_dsp:
+            if (constr.exp_anim is not None) or (constr.hit_anim is not None):
+                constr.draw_anim(surface)
+
     def tick(self, offset_y):
         """ Tick method, to be called every cycle """
+        self.offset_y = offset_y
+        self.anims.tick()
         for constr in self.constr_dsp:
             constr.tick(offset_y)
 
-    def add(self, y_pos, x_pos):
-        """ add new construct for position y, x """
-        rand_constr = random.randint(0, len(CONSTR_DEF) - 1)
-        constr = Constr(self, y_pos, x_pos, self.constr_def[rand_constr])
+    def add(self, y_pos, x_pos, constr_type=None):
+        """ add new construct for position y, x
+            constr_type - index in CONSTR_DEF (None = random), returns the type """
+        if constr_type is None:
+            constr_type = self.rand.randint(0, len(CONSTR_DEF) - 1)
+        constr = Constr(self, y_pos, x_pos, self.constr_def[constr_type])
         self.constr_dsp.append(constr)
-        print("add ", y_pos, x_pos, len(self.constr_dsp))
+        self.constr_grid[y_pos, x_pos] = len(self.constr_dsp) - 1
+        self.static_rows.add(y_pos)
+        return constr_type
 
     def scroll(self):
         """ scroll all constructs with one position down """
+        self.offset_y = 0
         for constr in self.constr_dsp:
             constr.row += 1
-            constr.y = constr.row * 64
+            constr.y_pos = constr.row * 64
+        self.static_rows = {row + 1 for row in self.static_rows if row + 1 < self.ty_out}
+        for constr in self.constr_dsp:
+            if constr.row >= self.ty_out:
+                constr.release()
+        self.constr_dsp[:] = [constr for constr in self.constr_dsp if constr.row < self.ty_out]
+        # rebuild grid index
+        self.constr_grid.fill(-1)
         for idx, constr in enumerate(self.constr_dsp):
-            if constr.row >= TY_OUT:
-                del self.constr_dsp[idx]
-                print("delete ", len(self.constr_dsp))
+            self.constr_grid[constr.row, constr.col] = idx
 
     def check_shots(self):
-        """ Check shots for all constructs """
-        for constr in self.constr_dsp:
-            for idx, shot in enumerate(self.shot_list):
-                if constr.check_hit(shot):
-                    # If construct hit, delete shot
-                    del self.shot_list[idx]
-                    break
+        """ Check shots for all constructs
+
+        Every shot is checked only against the construct placed in the grid cell
+        (64x64 plate) the shot is in. The construct in row r covers the interval
+        [r * 64 + offset_y - 64, r * 64 + offset_y] on axis Y (and the column c
+        [c * 64, c * 64 + 64] on axis X), a shot on the edge of a cell is also
+        checked against the neighbor construct above (left). As before, every
+        construct is hit by at most one shot per tick (the first one in the
+        pool), a shot hits only one construct. """
+        pool = self.shot_pool
+        cnt = pool.count
+        if (not self.constr_dsp) or (cnt == 0):
+            return
+        y_rel = pool.y_pos[:cnt] - self.offset_y
+        x_pos = pool.x_pos[:cnt]
+        rows = (y_rel // 64) + 1
+        cols = x_pos // 64
+        inside = (rows >= 0) & (rows < self.ty_out) & (cols >= 0) & (cols < self.tx_out)
+        shot_idx = np.flatnonzero(inside)
+        constr_idx = self.constr_grid[rows[shot_idx], cols[shot_idx]]
+        candidates = constr_idx >= 0
+        # (construct, shot) pairs, in shot (pool) order
+        pairs = list(zip(constr_idx[candidates].tolist(), shot_idx[candidates].tolist()))
+        # shots on the edge of a cell (Y or X multiple of 64)
+        edge_idx = np.flatnonzero(((y_rel & 63) * (x_pos & 63)) == 0)
+        if edge_idx.size:
+            for s_idx in edge_idx.tolist():
+                y_shot = int(y_rel[s_idx])
+                x_shot = int(x_pos[s_idx])
+                row = (y_shot // 64) + 1
+                col = x_shot // 64
+                # also the constructs above / left of the edge
+                up_row = row - 1 if (y_shot & 63) == 0 else row
+                left_col = col - 1 if (x_shot & 63) == 0 else col
+                for n_row, n_col in {(up_row, col), (row, left_col), (up_row, left_col)}:
+                    if ((n_row, n_col) != (row, col)) and (0 <= n_row < self.ty_out) and \
+                            (0 <= n_col < self.tx_out):
+                        c_idx = int(self.constr_grid[n_row, n_col])
+                        if c_idx >= 0:
+                            pairs.append((c_idx, s_idx))
+            # constructs in order, the shots of a construct in pool order
+            pairs.sort()
+        hit = set()
+        killed = set()
+        for c_idx, s_idx in pairs:
+            # construct already hit in this tick or shot already used
+            if (c_idx in hit) or (s_idx in killed):
+                continue
+            # If construct hit, delete shot
+            if self.constr_dsp[c_idx].check_hit(int(pool.x_pos[s_idx]), int(pool.y_pos[s_idx])):
+                pool.kill(s_idx)
+                hit.add(c_idx)
+                killed.add(s_idx)
+        if hit:
+            pool.compact()
 
         # delete all dead constructs
         #for idx, c in enumerate(self.constrDsp):
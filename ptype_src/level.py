@@ -0,0 +1,195 @@
+# This file is part of the PType distribution.
+# Copyright (c) 2020 Igor Marinescu (igor.marinescu@gmail.com).
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#-------------------------------------------------------------------------------
+""" Level Recording Module.
+
+A generated level is recorded (Level Recorder) in a compact binary file:
+every new top line of Plates with its constructs and every block of
+background Tiles. A recorded level is played (Level Stream) from the
+memory-mapped file, as line source of the Plates Manager and block source
+of the Back Tiles, instead of generating it.
+
+Record and play with:
+$ python -m ptype_src --seed 1 --record level.bin
+$ python -m ptype_src --play level.bin
+"""
+#-------------------------------------------------------------------------------
+# Level file:
+#
+#   +--------+---------+----------+----------+----------+----------+--------+----
+#   | magic  | version | pl. cols | pl. rows | bg. cols | bg. rows | record | ...
+#   | 8 byte | uint32  | uint16   | uint16   | uint16   | uint16   |        |
+#   +--------+---------+----------+----------+----------+----------+--------+----
+#
+#   Records, in the order they are generated:
+#
+#   Line:  | 'L' | plates cols x uint8 | cnt uint8 | cnt x (col uint8, type uint8) |
+#            Plate indexes of the new top line and the constructs placed on it
+#   Block: | 'B' | bg. rows x bg. cols x uint8 |
+#            Tile indexes of a block of background Tiles (row after row)
+#
+# The level starts with the empty ground (PlatesManager.generate_empty), the
+# lines are the lines scrolled in. At the end of the file the level ends
+# (reported once): next_line / next_block return None and the Plates Manager
+# and the Back Tiles generate the following lines and blocks again, the new
+# lines match the last recorded line. All values are uint8, recording a value
+# above 255 (ex. more than 256 Plates) is an error.
+#-------------------------------------------------------------------------------
+
+import sys
+import mmap
+import struct
+
+import numpy as np
+
+LEVEL_MAGIC = b'PTYPELVL'
+LEVEL_VERSION = 1
+LEVEL_HEADER = '<8sIHHHH'
+
+TAG_LINE = b'L'
+TAG_BLOCK = b'B'
+
+def uint8_bytes(values, what):
+    """ Return the values as bytes (uint8), ValueError if a value does not fit """
+    try:
+        return bytes(values)
+    except ValueError:
+        raise ValueError('{} do not fit in a level file (uint8, 0 .. 255): {}'.format(
+            what, list(values))) from None
+
+class LevelRecorder:
+    """ Level Recorder, line sink of the Plates Manager and block sink of the Back Tiles """
+
+    def __init__(self, filename, plates_man, b_tiles):
+        """ Create the level file and start recording (the background blocks in use
+            are recorded first) """
+        self.plates_man = plates_man
+        self.b_tiles = b_tiles
+        self.file = open(filename, 'wb')
+        self.file.write(struct.pack(LEVEL_HEADER, LEVEL_MAGIC, LEVEL_VERSION,
+            plates_man.tx_out, plates_man.ty_out, b_tiles.tx_cnt, b_tiles.ty_cnt))
+        plates_man.line_sink = self
+        b_tiles.set_block_sink(self)
+
+    def add_line(self, row, constr, constr_type):
+        """ Record a new top line of Plates and its constructs """
+        data = bytearray(TAG_LINE)
+        data += uint8_bytes(row, 'Plate indexes')
+        data += uint8_bytes([len(constr)], 'Number of constructs')
+        for col, c_type in zip(constr, constr_type):
+            data += uint8_bytes((col, c_type), 'Construct column and type')
+        self.file.write(data)
+
+    def add_block(self, cells):
+        """ Record a block of background Tiles """
+        self.file.write(TAG_BLOCK + uint8_bytes(cells, 'Tile indexes'))
+
+    def close(self):
+        """ Stop recording and close the file """
+        if self.file is None:
+            return
+        self.plates_man.line_sink = None
+        self.b_tiles.block_sink = None
+        self.file.close()
+        self.file = None
+
+class LevelStream:
+    """ Level Stream, plays a recorded level from the memory-mapped file.
+        Line source of the Plates Manager and block source of the Back Tiles """
+
+    def __init__(self, filename):
+        """ Open and memory-map the level file """
+        self.filename = filename
+        with open(filename, 'rb') as file:
+            self.mmap = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        header = struct.unpack_from(LEVEL_HEADER, self.mmap, 0)
+        if (header[0] != LEVEL_MAGIC) or (header[1] != LEVEL_VERSION):
+            raise ValueError('Not a PType level (version {}): {}'.format(LEVEL_VERSION,
+                filename))
+        self.plates_cols, self.plates_rows, self.back_cols, self.back_rows = header[2:]
+        self.data_start = struct.calcsize(LEVEL_HEADER)
+        self.line_pos = self.data_start
+        self.block_pos = self.data_start
+        self.ended = False       # end of the level reached (see end)
+
+    def play(self, plates_man, b_tiles):
+        """ Play the level: set as line source and block source (restarts both) """
+        if (plates_man.tx_out != self.plates_cols) or (plates_man.ty_out != self.plates_rows) or \
+                (b_tiles.tx_cnt != self.back_cols) or (b_tiles.ty_cnt != self.back_rows):
+            raise ValueError('Level recorded for another map size ({}x{} Plates, {}x{} Tiles): '
+                '{}'.format(self.plates_cols, self.plates_rows, self.back_cols, self.back_rows,
+                self.filename))
+        self.block_pos = self.data_start
+        self.ended = False
+        plates_man.set_line_source(self)
+        plates_man.generate_empty()
+        b_tiles.set_block_source(self)
+
+    def record_size(self, pos):
+        """ Return the size of the record at pos """
+        tag = self.mmap[pos:pos + 1]
+        if tag == TAG_LINE:
+            cnt = self.mmap[pos + 1 + self.plates_cols]
+            return 2 + self.plates_cols + (2 * cnt)
+        if tag == TAG_BLOCK:
+            return 1 + (self.back_rows * self.back_cols)
+        raise ValueError('Corrupted level file at {}: {}'.format(pos, self.filename))
+
+    def find(self, pos, tag):
+        """ Return the position of the next record with tag from pos
+            (None at the end of the file) """
+        end = len(self.mmap)
+        while pos < end:
+            if self.mmap[pos:pos + 1] == tag:
+                return pos
+            pos += self.record_size(pos)
+        return None
+
+    def end(self):
+        """ End of the level reached, report it (once) """
+        if not self.ended:
+            self.ended = True
+            print('End of level: {}'.format(self.filename), file=sys.stderr)
+
+    def start(self, top):
+        """ (Re)start the lines from the beginning of the level (top is ignored) """
+        self.line_pos = self.data_start
+
+    def next_line(self):
+        """ Return the next line (row, constr, constr_type), None at the end of the level """
+        pos = self.find(self.line_pos, TAG_LINE)
+        if pos is None:
+            self.end()
+            return None
+        cols = self.plates_cols
+        row = np.frombuffer(self.mmap, np.uint8, cols, pos + 1).tolist()
+        cnt = self.mmap[pos + 1 + cols]
+        constr = np.frombuffer(self.mmap, np.uint8, 2 * cnt, pos + 2 + cols).tolist()
+        self.line_pos = pos + self.record_size(pos)
+        return row, constr[0::2], constr[1::2]
+
+    def stop(self):
+        """ Stop playing lines """
+
+    def next_block(self):
+        """ Return the Tile indexes of the next block of background Tiles,
+            None at the end of the level """
+        pos = self.find(self.block_pos, TAG_BLOCK)
+        if pos is None:
+            self.end()
+            return None
+        self.block_pos = pos + self.record_size(pos)
+        return np.frombuffer(self.mmap, np.uint8, self.back_rows * self.back_cols,
+            pos + 1).tolist()
@@ -0,0 +1,204 @@
+# This file is part of the PType distribution.
+# Copyright (c) 2020 Igor Marinescu (igor.marinescu@gmail.com).
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#-------------------------------------------------------------------------------
+""" Level Statistics Module.
+
+Generates a large number of lines of Plates offline (without window), with
+the generation rules of the Plates Manager, in a pool of processes, and
+reports the Plates distribution, the construct density, the dead ends (no
+Plate matches, see PlatesManager.gen_line) and the generated lines per second
+per core. Used to tune the Plates images and weights without playing.
+
+Execute with:
+$ python -m ptype_src.levelstats --rows 1000000
+$ python -m ptype_src.levelstats --gen chunk --full-weight 4
+"""
+#-------------------------------------------------------------------------------
+# Jobs:
+# The lines are generated in jobs of JOB_ROWS lines, every job starts from an
+# empty bottom (as the first generated line of a map) and draws its random
+# values from its own random streams, seeded with (seed, job index). The
+# result is the same for the same seed, independent of the number of
+# processes.
+#
+# Every process loads the Plates once (pool initializer, dummy video driver)
+# and returns per job:
+#   (lines, plates count per Plate index, constructs, dead ends, cpu time)
+#-------------------------------------------------------------------------------
+
+import os
+import sys
+import time
+import argparse
+import concurrent.futures
+
+import numpy as np
+import pygame
+
+from . import randstream
+from . import platesman
+
+# Default number of lines generated in one job
+JOB_ROWS = 20000
+
+# Default Plates image (relative to the package path)
+PLATES_FILE = '/resources/plates64x64.png'
+
+# Plates Manager of the process (see init_worker)
+_PLATES_MAN = None
+
+def init_worker(path, plates_file, cols, full_weight):
+    """ Pool initializer: load the Plates in this process (no window) """
+    global _PLATES_MAN # pylint: disable=global-statement
+    # conversion to display format, no window required
+    os.environ['SDL_VIDEODRIVER'] = 'dummy'
+    pygame.display.init()
+    pygame.display.set_mode((1, 1))
+    plates_man = platesman.PlatesManager(path, None, tx_out=cols)
+    plates_man.load_plates(plates_file)
+    if full_weight is not None:
+        plates_man.set_plate_weights({p_idx: full_weight
+            for p_idx, plate in enumerate(plates_man.plates_def) if plate[4] == 4})
+    _PLATES_MAN = plates_man
+
+def run_job(seed, job, rows, gen):
+    """ Generate rows lines (job index job) with generator gen ('line' or 'chunk')
+        Returns (rows, plates count, constructs, dead ends, cpu time) """
+    plates_man = _PLATES_MAN
+    randstream.STREAMS.seed([seed, job])
+    plates_man.rand = randstream.STREAMS.get('PlatesManager')
+    counts = np.zeros(len(plates_man.plates_def), np.int64)
+    constr_cnt = 0
+    time0 = time.process_time()
+    if gen == 'chunk':
+        plates_gen = platesman.platesgen.PlatesGen(plates_man)
+        plates, constr = plates_gen.generate(None, rows)
+        counts += np.bincount(plates.ravel(), minlength=len(counts))
+        constr_cnt = int(np.count_nonzero(constr))
+        dead_ends = plates_gen.dead_ends
+    else:
+        plates_man.take_dead_ends()
+        bottom = None
+        row = [0] * plates_man.tx_out
+        for _ in range(rows):
+            row, constr = plates_man.gen_line(bottom, row)
+            counts += np.bincount(row, minlength=len(counts))
+            constr_cnt += len(constr)
+            bottom = row
+        dead_ends = plates_man.take_dead_ends()
+    return rows, counts, constr_cnt, dead_ends, time.process_time() - time0
+
+def load_plates_def(path, plates_file, cols, full_weight):
+    """ Return (plates_def, plates_weight) as loaded by the processes """
+    init_worker(path, plates_file, cols, full_weight)
+    return _PLATES_MAN.plates_def, _PLATES_MAN.plates_weight
+
+class LevelStats:
+    """ Level Statistics, sum of the job results """
+
+    def __init__(self, plates_def, plates_weight, cols):
+        self.plates_def = plates_def
+        self.plates_weight = plates_weight
+        self.cols = cols
+        self.rows = 0
+        self.counts = np.zeros(len(plates_def), np.int64)
+        self.constr = 0
+        self.dead_ends = 0
+        self.cpu_time = 0.0
+        self.wall_time = 0.0
+
+    def add(self, result):
+        """ Add the result of a job """
+        rows, counts, constr, dead_ends, cpu_time = result
+        self.rows += rows
+        self.counts += counts
+        self.constr += constr
+        self.dead_ends += dead_ends
+        self.cpu_time += cpu_time
+
+    def print(self, top=None):
+        """ Print the report, top - number of most frequent Plates listed (None = all) """
+        plates = max(1, self.rows * self.cols)
+        full = [p_idx for p_idx, plate in enumerate(self.plates_def) if plate[4] == 4]
+        full_cnt = int(self.counts[full].sum())
+        print('Lines: {}  Plates: {}  Wall: {:.2f}s  CPU: {:.2f}s'.format(self.rows,
+            self.rows * self.cols, self.wall_time, self.cpu_time))
+        print('Lines/s: {:.0f}  Lines/s per core: {:.0f}'.format(
+            self.rows / max(self.wall_time, 1e-9), self.rows / max(self.cpu_time, 1e-9)))
+        print('Dead ends: {} ({:.4f}% of Plates, {:.4f} per line)'.format(self.dead_ends,
+            self.dead_ends * 100.0 / plates, self.dead_ends / max(1, self.rows)))
+        print('Constructs: {} ({:.3f} per line, {:.2f}% of the full Plates)'.format(
+            self.constr, self.constr / max(1, self.rows), self.constr * 100.0 / max(1, full_cnt)))
+
+        print('{:<8}{:>8}'.format('Sum', '%'))
+        for p_sum in range(5):
+            sum_cnt = sum(int(self.counts[p_idx]) for p_idx, plate in
+                enumerate(self.plates_def) if plate[4] == p_sum)
+            print('{:<8}{:>8.2f}'.format(p_sum, sum_cnt * 100.0 / plates))
+
+        print('{:<8}{:<20}{:>8}{:>12}{:>8}'.format('Plate', '(U,R,B,L,Sum)', 'weight',
+            'count', '%'))
+        order = np.argsort(-self.counts, kind='stable')
+        if top is not None:
+            order = order[:top]
+        for p_idx in order.tolist():
+            print('{:<8}{:<20}{:>8.2f}{:>12}{:>8.2f}'.format(p_idx,
+                str(tuple(self.plates_def[p_idx])), self.plates_weight[p_idx],
+                int(self.counts[p_idx]), self.counts[p_idx] * 100.0 / plates))
+
+def main(argv=None):
+    """ Generate the lines and print the statistics """
+    path = os.path.dirname(os.path.realpath(os.path.abspath(__file__)))
+    parser = argparse.ArgumentParser(prog='ptype_src.levelstats',
+        description='Generate PType levels offline and report statistics')
+    parser.add_argument('--rows', type=int, default=1000000, help='number of lines')
+    parser.add_argument('--cols', type=int, default=platesman.TX_OUT, help='Plates in a line')
+    parser.add_argument('--jobs', type=int, default=None,
+        help='number of processes (default: number of cores)')
+    parser.add_argument('--job-rows', type=int, default=JOB_ROWS, help='lines in one job')
+    parser.add_argument('--gen', choices=('line', 'chunk'), default='line',
+        help='generator: PlatesManager.gen_line or the NumPy chunk generator')
+    parser.add_argument('--seed', type=int, default=None, help='seed (default: random)')
+    parser.add_argument('--plates', default=PLATES_FILE, help='Plates image')
+    parser.add_argument('--full-weight', type=float, default=None,
+        help='weight of the full Plates (default: {})'.format(platesman.FULL_PLATE_WEIGHT))
+    parser.add_argument('--top', type=int, default=None, help='list only the top N Plates')
+    args = parser.parse_args(argv)
+
+    seed = args.seed
+    if seed is None:
+        seed = randstream.STREAMS.seed_value
+    plates_def, plates_weight = load_plates_def(path, args.plates, args.cols,
+        args.full_weight)
+    stats = LevelStats(plates_def, plates_weight, args.cols)
+    jobs = [min(args.job_rows, args.rows - start) for start in
+            range(0, args.rows, args.job_rows)]
+
+    time0 = time.perf_counter()
+    with concurrent.futures.ProcessPoolExecutor(args.jobs, initializer=init_worker,
+            initargs=(path, args.plates, args.cols, args.full_weight)) as pool:
+        futures = [pool.submit(run_job, seed, job, rows, args.gen)
+                   for job, rows in enumerate(jobs)]
+        for future in concurrent.futures.as_completed(futures):
+            stats.add(future.result())
+    stats.wall_time = time.perf_counter() - time0
+
+    print('Seed: {}  Generator: {}  Processes: {}'.format(seed, args.gen,
+        args.jobs or os.cpu_count()))
+    stats.print(args.top)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,197 @@
+# This file is part of the PType distribution.
+# Copyright (c) 2020 Igor Marinescu (igor.marinescu@gmail.com).
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#-------------------------------------------------------------------------------
+""" Performance Monitor Module.
+
+Measures the time of every phase of a frame (input, update phases, display
+layers, flip) with one timer read per phase, keeps the last FRAME_WINDOW
+frames and shows the p50/p95/p99 of every phase in an overlay (toggled with
+key 4). Every frame can be streamed to a CSV file:
+$ python -m ptype_src --csv frames.csv
+"""
+#-------------------------------------------------------------------------------
+# Frame Timer:
+# A frame is started (start_frame), after every phase lap(name) adds the
+# time since the previous lap (or since the start) to the phase name. The
+# frame is ended (end_frame) and its times are stored in a ring buffer of the
+# last FRAME_WINDOW frames (one row per frame, one column per phase, the
+# last column is the whole frame):
+#
+#   start     lap('input')   lap('BackTiles.tick') ...  lap('flip')  end
+#     |<-- input -->|<-- BackTiles.tick -->|     ...    -->|
+#     |<-------------------------- frame ----------------->|
+#
+# The game declares all its phases in their fixed order before the first frame
+# (add_phases), so the columns are the same in the game, in the benchmark and
+# in the CSV file. A phase not declared is added when it is first measured.
+# The CSV header is written with the first row, the columns are fixed from then
+# on: phases added later are not written in the CSV file. The percentiles
+# are computed from the ring buffer only on request (the overlay refreshes its
+# text every OVERLAY_REFRESH frames, the text is rendered in a cached panel,
+# drawn with one blit every frame).
+#-------------------------------------------------------------------------------
+
+import csv
+import time
+
+import numpy as np
+import pygame
+
+# Number of frames kept for the percentiles
+FRAME_WINDOW = 600
+
+# Percentiles shown in the overlay
+PERCENTILES = (50, 95, 99)
+
+# Overlay text is rendered again every OVERLAY_REFRESH frames
+OVERLAY_REFRESH = 30
+
+# Name of the whole frame column
+FRAME = 'frame'
+
+class FrameTimer:
+    """ Frame Timer, time of every phase of the last frames """
+
+    def __init__(self, window=FRAME_WINDOW):
+        """ window - number of frames kept """
+        self.window = window
+        self.phases = [FRAME]    # phase names, column index in samples
+        self.phase_idx = {FRAME: 0}
+        self.samples = np.zeros((window, 1))
+        self.frames = 0          # number of ended frames
+        self.current = [0.0]     # phase times of the current frame
+        self.frame_start = 0.0
+        self.last = 0.0
+        self.csv_file = None
+        self.csv_writer = None
+        self.csv_phases = 0      # number of phases in the CSV header (0 = not written)
+
+    def start_frame(self):
+        """ Start a new frame """
+        self.current = [0.0] * len(self.phases)
+        self.frame_start = self.last = time.perf_counter()
+
+    def lap(self, name):
+        """ Add the time since the previous lap to phase name """
+        now = time.perf_counter()
+        idx = self.phase_idx.get(name)
+        if idx is None:
+            idx = self.add_phase(name)
+        self.current[idx] += now - self.last
+        self.last = now
+
+    def add_phases(self, names):
+        """ Add the phases (columns) in this order, the known ones are skipped """
+        for name in names:
+            if name not in self.phase_idx:
+                self.add_phase(name)
+
+    def add_phase(self, name):
+        """ Add a new phase (new column), returns its index """
+        idx = len(self.phases)
+        self.phases.append(name)
+        self.phase_idx[name] = idx
+        self.samples = np.hstack([self.samples, np.zeros((self.window, 1))])
+        self.current.append(0.0)
+        return idx
+
+    def end_frame(self):
+        """ End the frame, store its times (and write them in the CSV file) """
+        current = self.current
+        current[0] = self.last - self.frame_start
+        self.samples[self.frames % self.window] = current
+        if self.csv_writer is not None:
+            self.write_csv(current)
+        self.frames += 1
+
+    def percentiles(self, percentiles=PERCENTILES):
+        """ Return {phase: [time of every percentile]} of the kept frames (seconds) """
+        cnt = min(self.frames, self.window)
+        if cnt == 0:
+            return {}
+        values = np.percentile(self.samples[:cnt], percentiles, axis=0)
+        return {name: values[:, idx].tolist() for idx, name in enumerate(self.phases)}
+
+    def open_csv(self, filename):
+        """ Stream every frame (times in microseconds) in the CSV file """
+        self.close_csv()
+        self.csv_file = open(filename, 'w', newline='')
+        self.csv_writer = csv.writer(self.csv_file)
+        self.csv_phases = 0
+
+    def write_csv(self, current):
+        """ Write a frame in the CSV file (the header with the first frame) """
+        if self.csv_phases == 0:
+            self.csv_phases = len(self.phases)
+            self.csv_writer.writerow(['frame_idx'] + self.phases)
+        self.csv_writer.writerow([self.frames] + [round(val * 1e6, 1)
+            for val in current[:self.csv_phases]])
+
+    def close_csv(self):
+        """ Close the CSV file """
+        if self.csv_file is not None:
+            self.csv_file.close()
+            self.csv_file = None
+            self.csv_writer = None
+
+class PerfOverlay:
+    """ Performance Overlay, percentiles of the Frame Timer drawn over the scene """
+
+    def __init__(self, frame_timer, pos=(4, 4), font_size=16, color=(255, 255, 0)):
+        self.frame_timer = frame_timer
+        self.pos = pos
+        self.font_size = font_size
+        self.color = color
+        self.visible = False
+        self.font = None
+        self.panel = None        # cached rendered text
+        self.refresh_frame = None
+
+    def toggle(self):
+        """ Show / hide the overlay """
+        self.visible = not self.visible
+        self.refresh_frame = None
+
+    def render(self):
+        """ Render the text in the panel (cached until the next refresh) """
+        if self.font is None:
+            pygame.font.init()
+            self.font = pygame.font.Font(None, self.font_size)
+        text = ['{:<28}{:>8}{:>8}{:>8}'.format('[us]', *['p{}'.format(val)
+            for val in PERCENTILES])]
+        for name, values in self.frame_timer.percentiles().items():
+            text.append('{:<28}{:>8.0f}{:>8.0f}{:>8.0f}'.format(name,
+                *[val * 1e6 for val in values]))
+        height = self.font.get_linesize()
+        # names and values in two columns, black is transparent (no antialiasing, RLE)
+        col_x = self.font_size * 10
+        lines = [(self.font.render(line[:28], False, self.color),
+                  self.font.render(line[28:], False, self.color)) for line in text]
+        width = col_x + max(values.get_width() for _, values in lines)
+        self.panel = pygame.Surface((width, height * len(lines)))
+        self.panel.set_colorkey((0, 0, 0), pygame.RLEACCEL)
+        for idx, (name, values) in enumerate(lines):
+            self.panel.blit(name, (0, idx * height))
+            self.panel.blit(values, (col_x, idx * height))
+        self.refresh_frame = self.frame_timer.frames
+
+    def draw(self, surface):
+        """ Draw the overlay (if visible), returns the drawn rectangle (None if hidden) """
+        if not self.visible:
+            return None
+        if (self.refresh_frame is None) or \
+                (self.frame_timer.frames - self.refresh_frame >= OVERLAY_REFRESH):
+            self.render()
+        return surface.blit(self.panel, self.pos)
@@ -0,0 +1,222 @@
+# This file is part of the PType distribution.
+# Copyright (c) 2020 Igor Marinescu (igor.marinescu@gmail.com).
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#-------------------------------------------------------------------------------
+""" Plates Chunk Generator Module. """
+#-------------------------------------------------------------------------------
+# Chunk Generator:
+# Generates a whole chunk of lines of Plates at once with NumPy, with the same
+# edge matching rules as PlatesManager.gen_line (see platesman.py): the B edge
+# of a Plate matches the U edge of the Plate below, the L edge matches the R
+# edge of the Plate on the left.
+#
+# The chunk is generated column by column, all rows of a column at once.
+# The L edges of a column are known (R edges of the previous column), but the
+# B edge of every cell depends on the Plate chosen below it. Since an edge has
+# only a few values (4), the Plate is first chosen for all possible B values
+# of every cell, which gives for every row r a transition table of the edges:
+#
+#   trans[r][b] = U edge of the Plate chosen in row r if its B edge is b
+#               = B edge of row r + 1
+#
+#   B edges:  b[0] = U edge of the bottom line
+#             b[r + 1] = trans[r][b[r]] = (trans[r] o ... o trans[0])(b[0])
+#
+# The compositions (trans[r] o ... o trans[0]) of all rows are computed with
+# a parallel prefix scan (log2(rows) vectorized steps, see scan_edges).
+#
+# Edge tables (NumPy arrays, lb = L * n + B, n = number of edge values,
+# see platesman.EDGE_VALUES), the weighted choice is done
+# with the Alias Tables of the Plates Manager (see alias.py):
+#   cand[lb, k]  - k-th Plate index of alias_lb[L][B] (padded with 0)
+#   cand_prob[lb, k], cand_alias[lb, k] - prob and alias of alias_lb[L][B]
+#   cand_cnt[lb] - number of Plates in alias_lb[L][B]
+#   first_l[b, k], first_cnt[b] - the L values with Plates for B = b
+#                  (first column, L is chosen randomly, like gen_line)
+#   cand_b... [b, k] - the same for all Plates with B = b (dead end fallback)
+#
+# All random values of a chunk are drawn at once. A cell without any matching
+# Plate (dead end) gets a Plate matching only the bottom edge, dead ends are
+# counted (dead_ends).
+#-------------------------------------------------------------------------------
+
+import numpy as np
+
+from . import alias
+from . import randstream
+
+# Default number of lines generated in one chunk
+CHUNK_ROWS = 64
+
+# Probability of a construct on a full Plate (as gen_line: randint(0, 2) == 0)
+CONSTR_PROB = 1.0 / 3.0
+
+def pad_table(lists):
+    """ Convert a list of lists in a padded (len(lists), max_len) array and the lengths """
+    cnt = np.array([len(lst) for lst in lists], np.intp)
+    table = np.zeros((len(lists), max(1, int(cnt.max(initial=0)))), np.intp)
+    for idx, lst in enumerate(lists):
+        table[idx, :len(lst)] = lst
+    return table, cnt
+
+def pad_alias(tables):
+    """ Convert a list of Alias Tables in padded (len(tables), max_len) arrays.
+        Returns (items, prob, alias, lengths) """
+    items, cnt = pad_table([table.items for table in tables])
+    prob = np.ones(items.shape)
+    alias_idx = np.zeros(items.shape, np.intp)
+    for idx, table in enumerate(tables):
+        prob[idx, :len(table)] = table.prob
+        alias_idx[idx, :len(table)] = table.alias
+    return items, prob, alias_idx, cnt
+
+def alias_choice(tables, idx, rnd):
+    """ Vectorized weighted choice in the padded Alias Tables (see pad_alias)
+        idx - array of table indexes, rnd - array of uniform random values in [0, 1) """
+    items, prob, alias_idx, cnt = tables
+    pos = rnd * cnt[idx]
+    k = pos.astype(np.intp)
+    k = np.where((pos - k) < prob[idx, k], k, alias_idx[idx, k])
+    return items[idx, k]
+
+def scan_edges(trans, first):
+    """ Return the edges b[r] of all rows, where b[0] = first and
+        b[r + 1] = trans[r][b[r]] (trans is a (rows, n) array of edge transitions) """
+    # prefix scan, after the step with shift s:
+    # comp[r] = trans[r] o trans[r - 1] o ... o trans[r - 2s + 1]
+    comp = trans.copy()
+    shift = 1
+    while shift < len(comp):
+        comp[shift:] = np.take_along_axis(comp[shift:], comp[:-shift], axis=1)
+        shift *= 2
+    edges = np.empty(len(comp), np.intp)
+    edges[0] = first
+    edges[1:] = comp[:-1, first]
+    return edges
+
+class PlatesGen:
+    """ Plates Chunk Generator """
+
+    def __init__(self, plates_man, rng=None):
+        """ Init generator for the Plates of plates_man
+            rng - numpy random Generator (None = the 'PlatesGen' random stream) """
+        self.plates_man = plates_man
+        self.cols = plates_man.tx_out
+        if rng is None:
+            rng = randstream.STREAMS.get('PlatesGen').generator
+        self.rng = rng
+        self.dead_ends = 0
+        self.update_tables()
+
+    def update_tables(self):
+        """ Build the edge tables from the Plates (and weights) of the Plates Manager """
+        plates_man = self.plates_man
+        plates_man.update_alias()
+        plates_def = np.array(plates_man.plates_def, np.intp).reshape(-1, 5)
+        nval = len(plates_man.match_matrix_lb)
+        self.nval = nval
+        self.p_up = plates_def[:, 0]
+        self.p_right = plates_def[:, 1]
+        self.p_full = plates_def[:, 4] == 4
+
+        self.cand = pad_alias([plates_man.alias_lb[l][b] for l in range(nval)
+            for b in range(nval)])
+        self.first_l, self.first_cnt = pad_table(
+            [[l for l in range(nval) if plates_man.alias_lb[l][b]] for b in range(nval)])
+        weights = plates_man.plates_weight
+        self.cand_b = pad_alias([alias.AliasTable(p_list, [weights[p_idx] for p_idx in p_list])
+            for p_list in [np.flatnonzero(plates_def[:, 2] == b).tolist() for b in range(nval)]])
+
+    def generate(self, bottom, rows, cols=None):
+        """ Generate rows lines of Plates above the line bottom
+            bottom - Plate indexes of the line below (None = no line below)
+            cols - number of Plates in a line (None = the width of the Plates Manager)
+            Returns (plates, constr) - (rows, cols) arrays, plates[0] is the line
+                directly above bottom, constr is True where a construct is placed """
+        if cols is None:
+            cols = self.cols if bottom is None else len(bottom)
+        rng = self.rng
+        plates = np.zeros((rows, cols), np.intp)
+        if rows == 0:
+            return plates, np.zeros((rows, cols), bool)
+
+        # U edges of the bottom line (B edges of the first line)
+        b_first = np.zeros(cols, np.intp)
+        if bottom is not None:
+            b_first = self.p_up[np.asarray(bottom, np.intp)]
+
+        # all random values of the chunk
+        rnd = rng.random((rows, cols))
+        rnd_first = rng.random((rows, 1))
+
+        rows_idx = np.arange(rows)
+        b_all = np.arange(self.nval)
+        lval = None
+        for x_pos in range(cols):
+            if x_pos == 0:
+                # first column, random L with Plates for B
+                lval_b = self.first_l[b_all, (rnd_first * self.first_cnt).astype(np.intp)]
+            else:
+                lval_b = lval[:, None]
+            # Plate of every row for all possible B edges
+            l_b = (lval_b * self.nval) + b_all
+            rnd_col = np.broadcast_to(rnd[:, x_pos:x_pos + 1], l_b.shape)
+            cands = alias_choice(self.cand, l_b, rnd_col)
+            dead = self.cand[3][l_b] == 0
+            if dead.any():
+                # dead end, match only the bottom edge
+                b_dead = np.broadcast_to(b_all, dead.shape)[dead]
+                cands[dead] = alias_choice(self.cand_b, b_dead, rnd_col[dead])
+
+            # B edge of every row, choose the Plates
+            bval = scan_edges(self.p_up[cands], b_first[x_pos])
+            p_idx = cands[rows_idx, bval]
+            self.dead_ends += int(np.count_nonzero(dead[rows_idx, bval]))
+            plates[:, x_pos] = p_idx
+            lval = self.p_right[p_idx]
+
+        constr = self.p_full[plates] & (rng.random((rows, cols)) < CONSTR_PROB)
+        return plates, constr
+
+class PlatesChunkSource:
+    """ Line source of the Plates Manager (see platesman.py),
+        the lines are generated in chunks by a Plates Chunk Generator """
+
+    def __init__(self, plates_gen, chunk_rows=CHUNK_ROWS):
+        """ plates_gen - Plates Chunk Generator
+            chunk_rows - number of lines generated at once """
+        self.plates_gen = plates_gen
+        self.chunk_rows = chunk_rows
+        self.bottom = None
+        self.lines = []
+
+    def start(self, top):
+        """ (Re)start generating the lines above the line top """
+        self.plates_gen.update_tables()
+        self.bottom = list(top)
+        self.lines = []
+
+    def next_line(self):
+        """ Return the next line (row, constr), generate a new chunk if required """
+        if not self.lines:
+            plates, constr = self.plates_gen.generate(self.bottom, self.chunk_rows)
+            self.bottom = plates[-1].tolist()
+            # pop() from the end, the first line is the last in the list
+            self.lines = [(row.tolist(), np.flatnonzero(row_constr).tolist())
+                for row, row_constr in zip(plates[::-1], constr[::-1])]
+        return self.lines.pop()
+
+    def stop(self):
+        """ Stop generating, the generated lines are discarded """
+        self.lines = []
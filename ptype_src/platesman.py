@@ -69,6 +69,17 @@
 #                  | 1 | 1 |  <----- | 1 | 1 |
 #                  +---+---+         +---+---+
 #
+# The edges are detected automatically from the Plate images: every edge is
+# the line of pixels EDGE_INSET pixels inside the Plate, split in
+# EDGE_SEGMENTS segments (2: the halves of the edge, as the corners above).
+# A segment is set if most of its pixels are not background, the edge value
+# is the bitmask of the set segments. Sum is the number of set corners, a Plate
+# with Sum == 4 is a "full" Plate.
+# The size of the Plates grid in the image is detected from the bounding box of
+# the not background pixels. All edges of all Plates are computed at once
+# (NumPy, surfarray) and are cached on disk (PLATES_CACHE_DIR), the cache file
+# name contains the SHA1 hash of the image.
+#
 # The definitions for all Plates are stored in a list, where every element
 # is a Plate defined by a (U,R,B,L) tuple:
 #
@@ -97,168 +108,460 @@
 # Using Match-Matrix we already have the list of all Plates that have L and B.
 # And we just choose randomly an element from this list.
 #-------------------------------------------------------------------------------
+# Plates Weights:
+# Every Plate has a (float) weight, the probability of a Plate to be chosen
+# from its Match-Matrix list is proportional to its weight. By default the
+# "full" Plates (Sum == 4) have the weight FULL_PLATE_WEIGHT, all others 1.0.
+# For every Match-Matrix list an Alias Table (see alias.py) is built, which
+# chooses a weighted random Plate in O(1):
+#
+#   alias_lb[L][B] = AliasTable(match_matrix_lb[L][B], weights of the Plates)
+#
+# The Alias Tables are built again (update_alias) after Plates are added or
+# the weights are changed, once for all the Plates of an image (add_plates) or
+# for all the weights changed at once (set_plate_weights).
+#-------------------------------------------------------------------------------
+# Displayed Plates:
+# The displayed Plates (indexes and images) are [ty_out x tx_out] Tile Maps
+# (see tilemap.py). The rows are stored in a ring buffer, scrolling rotates
+# the head row and the new top row is generated in place.
+# TX_OUT and TY_OUT are the default sizes, the real sizes are given at runtime.
+#-------------------------------------------------------------------------------
+# Plates Layer:
+# All displayed Plates and the static images of the constructs placed on them
+# are pre-composited in one cached surface (layer), drawn every cycle with one
+# blit at offset_y. Only the changed rows of the layer are rendered again
+# (layer_rows: a new line, a construct changes its image (destroyed)). On scroll
+# the layer is scrolled (Surface.scroll, 64 pixels down) and only the new top
+# line is rendered. The whole layer is rendered after the map is generated.
+# Only the construct animations (explosion, hit) are drawn every cycle.
+#-------------------------------------------------------------------------------
+# Line Source:
+# On scroll the new top line is taken from a line source instead of being
+# generated in place, if a line source is set. A line source provides the
+# methods:
+#   start(top)   - (re)start producing the lines above the line top
+#                  (list of Plate indexes of the current top line)
+#   next_line()  - return the next line as (row, constr): the Plate indexes and
+#                  the columns where a construct is placed, or as
+#                  (row, constr, constr_type) with the types of the constructs,
+#                  None if there are no more lines (ex. end of a recorded level:
+#                  the line source is removed, the lines are generated in place)
+#   stop()       - stop producing lines
+#
+# The default line source is the Plates Worker: a background thread which
+# generates the upcoming lines in advance (LOOKAHEAD lines) in a bounded queue.
+# Every generated line is the bottom line of the next one, the chain starts
+# from the current top line, so the edges always match:
+#
+#   worker:  top -> line1 -> line2 -> line3 -> line4  (queue full, wait)
+#   scroll:                   pop line1 = new top line
+#
+# The chain is restarted every time the map is generated again. The line
+# source is stopped while the Plates or their weights are changed (the worker
+# reads the Alias Tables), and restarted afterwards. Stopping drains the queue,
+# so a worker waiting for a free place in the queue ends at once. Every queued
+# line keeps the state of the random stream before it was generated: on stop
+# the stream is rewound to the first discarded line, so the level does not
+# depend on how many lines the worker generated in advance. If the worker
+# thread ends with an error, next_line raises it (instead of waiting forever).
+# Another line source is the Plates Chunk Source (see platesgen.py), which
+# generates the lines in chunks with NumPy, or a recorded level (see level.py).
+#
+# Every new top line (with the types of its constructs) is passed to the line
+# sink, if one is set (ex. to record the level, see level.py):
+#   add_line(row, constr, constr_type)
+#-------------------------------------------------------------------------------
 
-import os.path
-import random
+import os
+import json
+import queue
+import hashlib
+import threading
 import pygame
+import numpy as np
+
+from . import alias
+from . import resman
+from . import randstream
+from . import tilemap
+from . import platesgen
 
 TY_OUT = 11
 TX_OUT = 8
 
+# Number of lines generated in advance by the Plates Worker
+LOOKAHEAD = 4
+# Interval the Plates Worker is checked in, while waiting for a line (seconds)
+WORKER_POLL = 0.1
+
+# Default weight of the "full" Plates (the other Plates have weight 1.0)
+FULL_PLATE_WEIGHT = 9.0
+
+# Size of a Plate (pixels)
+PLATE_SIZE = 64
+# Number of segments of an edge, the edge values are 0 .. EDGE_VALUES - 1
+EDGE_SEGMENTS = 2
+EDGE_VALUES = 1 << EDGE_SEGMENTS
+# Distance of the detected edge line from the Plate border (pixels)
+EDGE_INSET = 1
+# Disk cache of the Plates definitions (relative to the package path)
+PLATES_CACHE_DIR = '/resources/cache'
+
+def detect_grid(fg_mask):
+    """ Return the number of Plates (tx_cnt, ty_cnt) in the image, from the bounding box
+        of the not background pixels (fg_mask[x, y] is True if pixel is not background) """
+    width, height = fg_mask.shape
+    cols = np.flatnonzero(fg_mask.any(axis=1))
+    rows = np.flatnonzero(fg_mask.any(axis=0))
+    if (len(cols) == 0) or (len(rows) == 0):
+        return 0, 0
+    tx_cnt = min((cols[-1] + PLATE_SIZE) // PLATE_SIZE, width // PLATE_SIZE)
+    ty_cnt = min((rows[-1] + PLATE_SIZE) // PLATE_SIZE, height // PLATE_SIZE)
+    return int(tx_cnt), int(ty_cnt)
+
+def edge_signatures(fg_mask, tx_cnt, ty_cnt, segments=EDGE_SEGMENTS, inset=EDGE_INSET):
+    """ Return the [U, R, B, L, Sum] definitions of all Plates (row after row) of the image,
+        all edges of all Plates are detected at once """
+    size = PLATE_SIZE
+    # [plate, x, y]
+    tiles = fg_mask[:tx_cnt * size, :ty_cnt * size].reshape(tx_cnt, size, ty_cnt, size)
+    tiles = tiles.transpose(2, 0, 1, 3).reshape(ty_cnt * tx_cnt, size, size)
+    # [plate, edge, pixel], Up and Bottom from left to right, Right and Left from top to bottom
+    edges = np.stack([tiles[:, :, inset], tiles[:, size - 1 - inset, :],
+                      tiles[:, :, size - 1 - inset], tiles[:, inset, :]], axis=1)
+    # a segment is set if most of its pixels are not background
+    filled = edges.reshape(len(tiles), 4, segments, size // segments).mean(axis=3) > 0.5
+    values = (filled * (1 << np.arange(segments))).sum(axis=2)
+    # Sum = number of set corners (every corner is in 2 edges)
+    p_sum = filled.sum(axis=(1, 2)) // segments
+    return [tuple(plate) for plate in np.column_stack([values, p_sum]).tolist()]
+
+def plates_cache_file(fullname, cache_dir):
+    """ Return the name of the cache file of the Plates definitions of image fullname """
+    with open(fullname, 'rb') as file:
+        digest = hashlib.sha1(file.read()).hexdigest()
+    return os.path.join(cache_dir, 'plates-{}-{}-{}-{}.json'.format(digest, PLATE_SIZE,
+        EDGE_SEGMENTS, EDGE_INSET))
+
+def read_plates_cache(cache_file):
+    """ Return ((tx_cnt, ty_cnt), plates_def) from the cache file, None if not cached """
+    if (cache_file is None) or (not os.path.isfile(cache_file)):
+        return None
+    with open(cache_file, 'r') as file:
+        cached = json.load(file)
+    return tuple(cached['grid']), [tuple(plate) for plate in cached['plates_def']]
+
+def write_plates_cache(cache_file, grid, plates_def):
+    """ Write the Plates definitions in the cache file (the cache is optional,
+        nothing is written if the cache directory cannot be created) """
+    if cache_file is None:
+        return
+    try:
+        os.makedirs(os.path.dirname(cache_file), exist_ok=True)
+        tmp_file = cache_file + '.tmp'
+        with open(tmp_file, 'w') as file:
+            json.dump({'grid': list(grid), 'plates_def': plates_def}, file)
+        os.replace(tmp_file, cache_file)
+    except OSError:
+        pass
+
+def decode_plates(fullname, cache_dir=None):
+    """ Load image file and decode all plates in it.
+        cache_dir - directory of the Plates definitions disk cache (None = no cache)
+        Returns (plates_img, plates_def) """
+    # open image, reference colorkey is the color at point (0, 0)
+    img_key, img_surface, _ = resman.get_image(fullname, colorkeypos=(0, 0))
+
+    cache_file = None
+    if cache_dir is not None:
+        cache_file = plates_cache_file(fullname, cache_dir)
+    cached = read_plates_cache(cache_file)
+    if cached is not None:
+        (tx_cnt, ty_cnt), plates_def = cached
+    else:
+        # not background pixels, background is the color at point (0, 0)
+        fg_mask = pygame.surfarray.array2d(img_surface)
+        fg_mask = fg_mask != fg_mask[0, 0]
+        # How many full 64x64 Plates are in the image
+        tx_cnt, ty_cnt = detect_grid(fg_mask)
+        # Plates [U, R, B, L, Sum] definitions
+        plates_def = edge_signatures(fg_mask, tx_cnt, ty_cnt)
+        write_plates_cache(cache_file, (tx_cnt, ty_cnt), plates_def)
+
+    # Copy of the image without RLE, the background (colorkey) becomes black
+    # (a RLE image is encoded again for every new Plate surface blitted to)
+    sheet = pygame.Surface(img_surface.get_size())
+    sheet.blit(img_surface, (0, 0))
+
+    # Extract every 64x64 Plate image from image
+    plates_img = []
+    for j in range(ty_cnt):
+        for i in range(tx_cnt):
+            surf = sheet.subsurface(((i * PLATE_SIZE), (j * PLATE_SIZE),
+                PLATE_SIZE, PLATE_SIZE)).copy()
+            surf.set_colorkey((0, 0, 0))
+            plates_img.append(surf)
+
+    resman.ASSET_CACHE.release(img_key)
+    return plates_img, plates_def
+
 class PlatesManager:
     """ Plates Manager """
 
-    def __init__(self, path, constr_man):
-        """ Init Plates Manager """
+    def __init__(self, path, constr_man, tx_out=TX_OUT, ty_out=TY_OUT):
+        """ Init Plates Manager
+            tx_out, ty_out - number of displayed Plates on axis X and Y """
         self.path = path
+        self.rand = randstream.STREAMS.get('PlatesManager')
+        self.tx_out = tx_out
+        self.ty_out = ty_out
 
         self.plates_def = []     # Plates Definitions
         self.plates_img = []     # Plates Images
-        self.disp_idx = [[0    for x in range(TX_OUT)] for y in range(TY_OUT)]
-        self.disp_img = [[None for x in range(TX_OUT)] for y in range(TY_OUT)]
-        self.match_matrix_lb = [[[] for x in range(4)] for y in range(4)]
+        self.disp_idx = tilemap.TileMap(ty_out, tx_out, 0)
+        self.disp_img = tilemap.TileMap(ty_out, tx_out, None)
+        self.layer = None        # Cached Plates Layer (see render_layer)
+        self.layer_dirty = True  # Layer must be rendered again (whole)
+        self.layer_rows = set()  # Rows of the layer to be rendered again
+        self.layer_scroll = 0    # Number of lines scrolled since the layer was rendered
+        self.plates_weight = []  # Plates Weights
+        self.match_matrix_lb = [[[] for x in range(EDGE_VALUES)] for y in range(EDGE_VALUES)]
+        self.alias_lb = None     # Alias Tables of the Match Matrix (see update_alias)
+        self.dead_ends = 0       # Number of Plates without any match (see gen_line)
+        self.dead_ends_lock = threading.Lock()  # dead_ends is counted by the worker too
+        self.cache_keys = []     # keys of the assets acquired from resman.ASSET_CACHE
 
         self.scroll_cnt = 0
         self.offset_y = 0
         self.constr_man = constr_man
+        self.line_source = None  # Source of the new top lines (None = generate in place)
+        self.line_sink = None    # Receives all new top lines (None = no sink)
 
     def load_plates(self, filename):
-        """ Load all plates from image file, decode them and append to existing list """
-
-        # open image
+        """ Load all plates from image file, decode them and append to existing list
+            (the decoded plates are shared through the asset cache) """
         fullname = os.path.join('', self.path + filename)
-        try:
-            img_surface = pygame.image.load(fullname)
-        except pygame.error as message:
-            print('Cannot load image:', fullname)
-            raise SystemExit(message) from message
+        key = ('plates', os.path.normpath(fullname))
+        cache_dir = self.path + PLATES_CACHE_DIR
+        plates_img, plates_def = resman.ASSET_CACHE.acquire(key,
+            lambda: decode_plates(fullname, cache_dir))
+        self.cache_keys.append(key)
+        self.add_plates(plates_img, plates_def)
 
-        img_surface = img_surface.convert()
-        #img_rect = imgSurface.get_rect()
+    def load_plates_bundle(self, bundle, name):
+        """ Load all plates (images and definitions) of entry name from an asset bundle """
+        self.add_plates(bundle.tiles(name), bundle.plates_def(name))
 
-        # get reference colorkey (point 0, 0)
-        ref_colorkey = img_surface.get_at((0, 0))
-        img_surface.set_colorkey(ref_colorkey, pygame.RLEACCEL)
+    def add_plate(self, surf, plate, weight=None):
+        """ Append a Plate (image and [U, R, B, L, Sum] definition)
+            weight - weight of the Plate (None = default weight) """
+        self.add_plates([surf], [plate], [weight])
 
-        # How many full 64x64 Plates are in the image
-        ty_cnt = 10 #int(imgRect[3]/64)
-        tx_cnt = 6 #int(imgRect[2]/64)
-
-        # Extract every 64x64 Plate from image
-        for j in range(ty_cnt):
-            for i in range(tx_cnt):
-
-                # Plate image
-                surf = pygame.Surface((64, 64))
-                surf.blit(img_surface, (0, 0), ((i * 64), (j * 64), 64, 64))
-                back_colorkey = (0, 0, 0)
-                surf.set_colorkey(back_colorkey)
-                self.plates_img.append(surf)
-
-                # Plate [U, R, B, L, Sum] definitions
-                plate = [0, 0, 0, 0, 0]
-                p_sum = 0
-                # Check the corners (top-left, top-right, bottom-right, bottom-left)
-                # and automatically detect the plate's definitions
-                # (if the corner has or not a background color)
-                if surf.get_at((1, 1)) != back_colorkey:
-                    plate[0] += 1  # Up += 1
-                    plate[3] += 1  # Left += 1
-                    p_sum += 1
-                if surf.get_at((62, 1)) != back_colorkey:
-                    plate[0] += 2  # Up += 2
-                    plate[1] += 1  # Right += 1
-                    p_sum += 1
-                if surf.get_at((1, 62)) != back_colorkey:
-                    plate[2] += 1  # Bottom += 1
-                    plate[3] += 2  # Left += 2
-                    p_sum += 1
-                if surf.get_at((62, 62)) != back_colorkey:
-                    plate[1] += 2  # Right += 2
-                    plate[2] += 2  # Bottom += 2
-                    p_sum += 1
-                plate[4] = p_sum
-                self.plates_def.append(tuple(plate))
-                p_idx = len(self.plates_def) - 1
-
-                # Insert Plate Index in Match Matrix L-B ([Left=3][Bottom=2])
-                self.match_matrix_lb[plate[3]][plate[2]].append(p_idx)
-
-                # Artificially increase the number of "full" plates
-                # by insering more similare plates in the matchMatrix
-                # which increases the probability of the "full" plates
-                if p_sum == 4:#4
-                    p_sum = 8
-                    while p_sum > 0:
-                        self.match_matrix_lb[plate[3]][plate[2]].append(p_idx)
-                        p_sum -= 1
-
-    def generate_line(self, y_pos):
-        """ Generate one line of Plates """
+    def add_plates(self, surfs, plates, weights=None):
+        """ Append Plates (images and [U, R, B, L, Sum] definitions), the line source
+            is restarted once for all of them
+            weights - weights of the Plates (None = default weights) """
+        if weights is None:
+            weights = [None] * len(plates)
+        # the line source reads the Alias Tables, stopped while they change
+        if self.line_source is not None:
+            self.line_source.stop()
+        for surf, plate, weight in zip(surfs, plates, weights):
+            if weight is None:
+                # increase the probability of the "full" plates
+                weight = FULL_PLATE_WEIGHT if plate[4] == 4 else 1.0
+            self.plates_img.append(surf)
+            self.plates_def.append(plate)
+            self.plates_weight.append(float(weight))
+            p_idx = len(self.plates_def) - 1
+
+            # Insert Plate Index in Match Matrix L-B ([Left=3][Bottom=2])
+            self.match_matrix_lb[plate[3]][plate[2]].append(p_idx)
+        self.alias_lb = None
+        self.restart_line_source()
+
+    def set_plate_weight(self, p_idx, weight):
+        """ Change the weight of Plate p_idx """
+        self.set_plate_weights({p_idx: weight})
+
+    def set_plate_weights(self, weights):
+        """ Change the weights of Plates ({p_idx: weight}), the line source is
+            restarted once for all of them """
+        # the line source reads the Alias Tables, stopped while they change
+        if self.line_source is not None:
+            self.line_source.stop()
+        for p_idx, weight in weights.items():
+            self.plates_weight[p_idx] = float(weight)
+        self.alias_lb = None
+        self.restart_line_source()
+
+    def update_alias(self):
+        """ Build the Alias Tables of the Match Matrix, if not up to date """
+        if self.alias_lb is not None:
+            return
+        weights = self.plates_weight
+        self.alias_lb = [[alias.AliasTable(mat, [weights[p_idx] for p_idx in mat])
+                          for mat in mat_l] for mat_l in self.match_matrix_lb]
+
+    def release(self):
+        """ Release all plates (back to the asset cache) """
+        for key in self.cache_keys:
+            resman.ASSET_CACHE.release(key)
+        self.cache_keys = []
+
+    def gen_line(self, bottom, row):
+        """ Generate one line of Plates (does not change the map, thread safe)
+            bottom - Plate indexes of the line below (None if it is the last line)
+            row - current Plate indexes of the line (kept if no Plate matches)
+            Returns (row, constr) - new Plate indexes and the columns of the constructs """
+        row = list(row)
+        constr = []
+        dead_ends = 0
+        self.update_alias()
 
         lval = None
-        for i in range(0, TX_OUT):
+        for i in range(0, self.tx_out):
             bval = 0
 
             # If not the last line, get the plate from next line
-            if y_pos < (TY_OUT - 1):
-                plate = self.plates_def[self.disp_idx[y_pos + 1][i]]
+            if bottom is not None:
+                plate = self.plates_def[bottom[i]]
                 # Get Up-Side of the bottom-plate
                 bval = plate[0] # 0=Up
 
             if i > 0:
                 # Get left plate
-                plate = self.plates_def[self.disp_idx[y_pos][i - 1]]
+                plate = self.plates_def[row[i - 1]]
                 # Get Right side of the left-plate
                 lval = plate[1] #1=Right
             else:
                 # In case this is the first column
                 # get a random value for R that matches bottom-plate
                 while lval is None:
-                    mat = self.match_matrix_lb[random.randint(0, 3)][bval]
-                    if len(mat) > 0:
-                        p_idx = mat[random.randint(0, len(mat) - 1)]
+                    table = self.alias_lb[self.rand.randint(0, EDGE_VALUES - 1)][bval]
+                    if len(table) > 0:
+                        p_idx = table.choice(self.rand.random())
                         plate = self.plates_def[p_idx]
                         lval = plate[3] #3=Left
 
-            mat = self.match_matrix_lb[lval][bval]
-            if len(mat) > 0:
-                p_idx = mat[random.randint(0, len(mat) - 1)]
-                self.disp_idx[y_pos][i] = p_idx
-                self.disp_img[y_pos][i] = self.plates_img[p_idx]
+            table = self.alias_lb[lval][bval]
+            if len(table) > 0:
+                p_idx = table.choice(self.rand.random())
+                row[i] = p_idx
                 # If it is a full plate (pSum == 4) place a construct on it
                 plate = self.plates_def[p_idx]
-                if (plate[4] == 4) and (random.randint(0, 2) == 0):
-                    self.constr_man.add(y_pos, i)
+                if (plate[4] == 4) and (self.rand.randint(0, 2) == 0):
+                    constr.append(i)
             else:
-                print("!!!!!")
+                # dead end, no Plate matches L and B, the Plate is kept
+                dead_ends += 1
+
+        if dead_ends > 0:
+            with self.dead_ends_lock:
+                self.dead_ends += dead_ends
+        return row, constr
+
+    def take_dead_ends(self):
+        """ Return the number of dead ends counted since the last call and reset it """
+        with self.dead_ends_lock:
+            dead_ends = self.dead_ends
+            self.dead_ends = 0
+        return dead_ends
+
+    def put_line(self, y_pos, row, constr, constr_type=None):
+        """ Set line y_pos of the map and place the constructs on it
+            constr_type - types of the constructs (None = random types)
+            Returns the types of the placed constructs """
+        self.layer_rows.add(y_pos)
+        self.disp_idx.set_row(y_pos, row)
+        self.disp_img.set_row(y_pos, [self.plates_img[p_idx] for p_idx in row])
+        if constr_type is None:
+            constr_type = [None] * len(constr)
+        return [self.constr_man.add(y_pos, i, c_type) for i, c_type in zip(constr, constr_type)]
+
+    def generate_line(self, y_pos, keep=None):
+        """ Generate one line of Plates, returns (row, constr, constr_type)
+            keep - Plate indexes kept if no Plate matches (None = the current line) """
+        bottom = None
+        # If not the last line, match the plates of the next line
+        if y_pos < (self.ty_out - 1):
+            bottom = self.disp_idx.get_row(y_pos + 1)
+        if keep is None:
+            keep = self.disp_idx.get_row(y_pos)
+        row, constr = self.gen_line(bottom, keep)
+        return row, constr, self.put_line(y_pos, row, constr)
 
     def generate(self):
         """ Generate a new Ground from Plates """
-        for j in range(TY_OUT - 1, -1, -1):
+        # the line source uses the same random stream, restarted when done
+        if self.line_source is not None:
+            self.line_source.stop()
+        for j in range(self.ty_out - 1, -1, -1):
             self.generate_line(j)
+        self.restart_line_source()
 
     def generate_empty(self):
         """ Generate a new empty Ground """
-        for j in range(TY_OUT - 1, -1, -1):
-            for i in range(0, TX_OUT):
-                mat = self.match_matrix_lb[0][0]
-                p_idx = mat[0]
-                self.disp_idx[j][i] = p_idx
-                self.disp_img[j][i] = self.plates_img[p_idx]
+        p_idx = self.match_matrix_lb[0][0][0]
+        self.disp_idx.fill(p_idx)
+        self.disp_img.fill(self.plates_img[p_idx])
+        self.layer_dirty = True
+        self.restart_line_source()
+
+    def set_line_source(self, line_source):
+        """ Set the source of the new top lines (None = generate in place) """
+        if self.line_source is not None:
+            self.line_source.stop()
+        self.line_source = line_source
+        self.restart_line_source()
+
+    def restart_line_source(self):
+        """ Restart the line source from the current top line """
+        if self.line_source is not None:
+            self.update_alias()
+            self.line_source.start(self.disp_idx.get_row(0))
+
+    def start_worker(self, lookahead=LOOKAHEAD):
+        """ Generate the new top lines in advance in a background thread """
+        self.set_line_source(PlatesWorker(self, lookahead))
+
+    def start_chunk_gen(self, chunk_rows=platesgen.CHUNK_ROWS, rng=None):
+        """ Generate the new top lines in chunks of chunk_rows lines (see platesgen.py)
+            rng - numpy random Generator (None = the 'PlatesGen' random stream) """
+        self.set_line_source(platesgen.PlatesChunkSource(platesgen.PlatesGen(self, rng),
+            chunk_rows))
+
+    def stop_worker(self):
+        """ Stop the line source, the new top lines are generated in place again """
+        self.set_line_source(None)
 
     def scroll(self):
         """ Scroll all Plates with one line down
             (the last line is lost, the first line is newly generated) """
         # Scroll all plates with one position down
-        for j in range(TY_OUT - 1, 0, -1):
-            for i in range(TX_OUT):
-                self.disp_idx[j][i] = self.disp_idx[j - 1][i]
-                self.disp_img[j][i] = self.disp_img[j - 1][i]
+        self.disp_idx.scroll()
+        self.disp_img.scroll()
         # Scroll constructs
         self.constr_man.scroll()
-        # Generate new top line
-        self.generate_line(0)
+        # Scroll the layer, the new top line is rendered
+        self.layer_scroll += 1
+        self.layer_rows = {row + 1 for row in self.layer_rows if row + 1 < self.ty_out}
+        # Generate new top line (or take it from the line source)
+        line = None
+        if self.line_source is not None:
+            line = self.line_source.next_line()
+            if line is None:
+                # no more lines, generated in place from now on
+                self.set_line_source(None)
+        if line is not None:
+            row, constr = line[0], line[1]
+            constr_type = self.put_line(0, *line)
+        else:
+            # where no plate matches, keep the plate below (as the line source)
+            row, constr, constr_type = self.generate_line(0, self.disp_idx.get_row(1))
+        if self.line_sink is not None:
+            self.line_sink.add_line(row, constr, constr_type)
 
     def print_plates(self):
         """ Print plates info """
@@ -268,14 +571,43 @@ class PlatesManager:
         #    for il in jl:
         #        print(il)
 
+    def render_row(self, j):
+        """ Composite the Plates of row j in the layer (without constructs) """
+        self.layer.fill((0, 0, 0), (0, j * 64, self.tx_out * 64, 64))
+        for i, img in enumerate(self.disp_img.get_row(j)):
+            if img is not None:
+                self.layer.blit(img, ((i * 64), (j * 64)))
+
+    def render_layer(self):
+        """ Composite the changed Plates and static images of constructs in the layer.
+            On scroll the layer is scrolled (Surface.scroll), only the new rows are rendered """
+        if self.layer is None:
+            self.layer = pygame.Surface((self.tx_out * 64, self.ty_out * 64))
+            # no RLEACCEL, the layer is changed every 64 ticks
+            self.layer.set_colorkey((0, 0, 0))
+            self.layer_dirty = True
+        if self.layer_dirty:
+            rows = None
+            for j in range(self.ty_out):
+                self.render_row(j)
+        else:
+            if self.layer_scroll > 0:
+                self.layer.scroll(0, self.layer_scroll * 64)
+            rows = self.layer_rows | self.constr_man.static_rows
+            for j in rows:
+                self.render_row(j)
+        self.constr_man.draw_static(self.layer, rows)
+        self.layer_dirty = False
+        self.layer_rows = set()
+        self.layer_scroll = 0
+
     def draw(self, surface):
         """ Draw plates """
-        for j in range(TY_OUT):
-            for i in range(TX_OUT):
-                img = self.disp_img[j][i]
-                if img is not None:
-                    surface.blit(img, ((i * 64), self.offset_y + (j * 64) - 64))
-        self.constr_man.draw(surface)
+        if self.layer_dirty or self.layer_scroll or self.layer_rows or \
+                self.constr_man.static_rows:
+            self.render_layer()
+        surface.blit(self.layer, (0, self.offset_y - 64))
+        self.constr_man.draw_anim(surface)
 
     def tick(self):
         """ Tick method, to be caled every cycle """
@@ -285,3 +617,90 @@ class PlatesManager:
             self.scroll()
         else:
             self.constr_man.tick(self.offset_y)
+
+class PlatesWorker:
+    """ Plates Worker, generates the upcoming lines in a background thread """
+
+    def __init__(self, plates_man, lookahead=LOOKAHEAD):
+        """ Init Plates Worker
+            lookahead - maximal number of lines generated in advance """
+        self.plates_man = plates_man
+        self.lookahead = lookahead
+        self.lines = None
+        self.stop_event = None
+        self.thread = None
+        self.error = None        # exception the thread ended with
+        self.unsent = None       # random state of the line generated but not queued
+
+    def start(self, top):
+        """ (Re)start generating the lines above the line top """
+        self.stop()
+        self.error = None
+        self.unsent = None
+        self.lines = queue.Queue(self.lookahead)
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True,
+            args=(list(top), self.lines, self.stop_event))
+        self.thread.start()
+
+    def run(self, top, lines, stop_event):
+        """ Thread function, every generated line is the bottom line of the next one """
+        bottom = top
+        rand = self.plates_man.rand
+        try:
+            while not stop_event.is_set():
+                state = rand.get_state()
+                # where no plate matches the bottom line, keep the bottom plate
+                row, constr = self.plates_man.gen_line(bottom, bottom)
+                while True:
+                    if stop_event.is_set():
+                        self.unsent = state
+                        return
+                    try:
+                        lines.put((row, constr, state), timeout=WORKER_POLL)
+                        break
+                    except queue.Full:
+                        pass
+                bottom = row
+        except Exception as err: # pylint: disable=broad-except
+            # raised in the main thread by next_line
+            self.error = err
+
+    def next_line(self):
+        """ Return the next line (row, constr), wait if it is not generated yet.
+            Raises the error of the thread if it ended (RuntimeError if not started) """
+        while True:
+            if self.thread is None:
+                raise RuntimeError('Plates Worker not started')
+            try:
+                row, constr, _ = self.lines.get(timeout=WORKER_POLL)
+                return row, constr
+            except queue.Empty:
+                if not self.thread.is_alive():
+                    if self.error is not None:
+                        raise self.error
+                    raise RuntimeError('Plates Worker ended')
+
+    def drain(self):
+        """ Discard the generated lines (the thread waiting to put a line is woken),
+            returns the random states of the discarded lines """
+        states = []
+        while True:
+            try:
+                states.append(self.lines.get_nowait()[2])
+            except queue.Empty:
+                return states
+
+    def stop(self):
+        """ Stop generating, the generated lines are discarded and the random stream
+            is rewound to the first discarded line """
+        if self.thread is not None:
+            self.stop_event.set()
+            states = self.drain()
+            self.thread.join()
+            states += self.drain()
+            if self.unsent is not None:
+                states.append(self.unsent)
+            if states:
+                self.plates_man.rand.set_state(states[0])
+            self.thread = None
@@ -0,0 +1,126 @@
+# This file is part of the PType distribution.
+# Copyright (c) 2020 Igor Marinescu (igor.marinescu@gmail.com).
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#-------------------------------------------------------------------------------
+""" Presenter Module. """
+#-------------------------------------------------------------------------------
+# Presenter (dirty rectangles):
+# Instead of filling the whole display surface with the background color and
+# presenting it with pygame.display.flip every frame, only the changed regions
+# are cleared and presented (pygame.display.update(rects)).
+#
+# Every frame the rectangles of everything drawn (blits, shots, overlay) are
+# added (add, add_rects). A pixel outside of the rectangles of the previous
+# frame is still background color, so:
+#   clear     - fill only the rectangles of the previous frame
+#   present   - update the rectangles of the previous and of the current frame
+#               (what was drawn and what is drawn now)
+#
+#   frame n-1:  [ship]                 frame n:      [ship]
+#                                      clear/update: [prev] + [ship]
+#
+# The rectangles inside of other rectangles (ex. the ship inside of the
+# scrolling ground) are removed (merge_rects). Usually all the rectangles are
+# inside of the largest one (the ground), so the rectangles inside of the
+# largest one are removed in one sweep, only the few remaining rectangles are
+# compared with each other.
+# If the changed area is larger than max_ratio of the surface (ex. the
+# scrolling ground covers most of the screen), the whole surface is presented
+# with pygame.display.flip (fallback). After invalidate (ex. the overlay is
+# toggled, the window was exposed) or in flip mode the whole surface is
+# cleared and flipped.
+#-------------------------------------------------------------------------------
+
+import pygame
+
+# Maximal part of the surface presented with rectangles, above it: flip
+MAX_DIRTY_RATIO = 0.9
+
+def rect_area(rect):
+    """ Return the area of the rectangle """
+    return rect.width * rect.height
+
+def merge_rects(rects):
+    """ Return the rectangles without the rectangles contained in other rectangles """
+    if not rects:
+        return []
+    # one sweep: the rectangles inside of the largest one are removed
+    areas = [rect.w * rect.h for rect in rects]
+    largest = rects[areas.index(max(areas))]
+    contains = largest.contains
+    rest = [rect for rect in rects if not contains(rect)]
+    merged = [largest] if largest else []
+    # the remaining rectangles, the larger ones first
+    rest.sort(key=rect_area, reverse=True)
+    for rect in rest:
+        for big in merged:
+            if big.contains(rect):
+                break
+        else:
+            if rect:
+                merged.append(rect)
+    return merged
+
+class Presenter:
+    """ Presenter, dirty rectangles or flip """
+
+    def __init__(self, surface, dirty=True, max_ratio=MAX_DIRTY_RATIO):
+        """ surface - display surface
+            dirty - present dirty rectangles (False = always flip)
+            max_ratio - part of the surface above which flip is used """
+        self.surface = surface
+        self.rect = surface.get_rect()
+        self.dirty = dirty
+        self.max_area = self.rect.width * self.rect.height * max_ratio
+        self.prev_rects = []     # rectangles drawn in the previous frame
+        self.rects = []          # rectangles drawn in the current frame
+        self.full = True         # whole surface must be cleared and presented
+        self.flips = 0           # number of frames presented with flip
+        self.updates = 0         # number of frames presented with rectangles
+
+    def invalidate(self):
+        """ Clear and present the whole surface in the next frame """
+        self.full = True
+
+    def clear(self, color):
+        """ Clear (fill with color) the surface, or the rectangles of the previous frame """
+        if self.full or not self.dirty:
+            self.surface.fill(color)
+            return
+        fill = self.surface.fill
+        for rect in self.prev_rects:
+            fill(color, rect)
+
+    def add(self, rect):
+        """ Add a drawn rectangle of the current frame """
+        self.rects.append(rect)
+
+    def add_rects(self, rects):
+        """ Add a list of drawn rectangles of the current frame """
+        self.rects.extend(rects)
+
+    def present(self):
+        """ Present the frame: update the changed rectangles or flip the surface """
+        rects = merge_rects(self.prev_rects + self.rects)
+        if self.full or not self.dirty or \
+                (sum(map(rect_area, rects)) > self.max_area):
+            pygame.display.flip()
+            self.flips += 1
+        else:
+            pygame.display.update(rects)
+            self.updates += 1
+        # only the rectangles inside the surface are cleared next time
+        self.prev_rects = merge_rects([rect.clip(self.rect) for rect in self.rects])
+        self.rects = []
+        self.full = False
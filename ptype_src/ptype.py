@@ -15,6 +15,7 @@
 #-------------------------------------------------------------------------------
 """ PType Main Module. """
 
+import time
 import pygame
 
 from . import resman
@@ -24,6 +25,20 @@ from . import backtiles
 from . import res_def_backtiles
 from . import platesman
 from . import constrman
+from . import shotpool
+from . import bundle
+from . import level
+from . import perfmon
+from . import renderq
+from . import present
+
+# Texture images decoded in parallel at startup (see resman.preload_images)
+ASSETS = [ # (filename, colorkey, colorkeypos) as used by load_tiles/load_plates
+            ('/resources/stars.png', (0, 0, 0), None),
+            ('/resources/images.png', -1, None),
+            ('/resources/construct.png', -1, None),
+            ('/resources/plates64x64.png', None, (0, 0)),
+        ]
 
 def check_for_quit():
     """ Check if an exit-event occured """
@@ -49,43 +64,161 @@ class PType:
         pygame.display.set_caption('RubikQuat')
         self.background = (25,32,49)
         self.quit_flag = False
+        self.recorder = None
+        # time of every phase of the frame (see perfmon.py), overlay toggled with key 4
+        self.perf = perfmon.FrameTimer()
+        self.perf_overlay = perfmon.PerfOverlay(self.perf)
+
+        start = time.perf_counter()
+        # use the pre-sliced asset bundle (see bundle.py) if it is up to date,
+        # no image decoding at all
+        _, self.bundle = bundle.open_valid_bundle(path)
+        if self.bundle is not None:
+            self.load_report = resman.LoadReport()
+            self.load_report.assets.append((bundle.BUNDLE_FILE, time.perf_counter() - start, 0.0))
+        else:
+            # decode all texture images in parallel
+            self.load_report = resman.preload_images(
+                [(path + filename, colorkey, colorkeypos)
+                    for filename, colorkey, colorkeypos in ASSETS])
 
         # create Backtiles
-        self.resman_back = resman.ResourceManager(path)
-        self.resman_back.load_tiles('/resources/stars.png', res_def_backtiles.resDef)
+        self.resman_back = resman.ResourceManager(path, subsurface=True)
+        if self.bundle is not None:
+            self.resman_back.load_bundle_tiles(self.bundle, 'stars')
+        else:
+            self.resman_back.load_tiles('/resources/stars.png', res_def_backtiles.resDef)
         self.b_tiles = backtiles.BackTiles(self.resman_back)
 
         # create Ship
-        self.resman_ship = resman.ResourceManager(path)
-        self.resman_ship.load_tiles("/resources/images.png", res_def_ship.resDefShip, colorkey=-1)
+        self.resman_ship = resman.ResourceManager(path, subsurface=True)
+        if self.bundle is not None:
+            self.resman_ship.load_bundle_tiles(self.bundle, 'images')
+        else:
+            self.resman_ship.load_tiles("/resources/images.png", res_def_ship.resDefShip,
+                colorkey=-1)
         self.ship = ship.Ship(self.resman_ship, (200, 450))
-        # create list of shots
-        self.shot_list = []
+        # create pool of shots
+        self.shot_pool = shotpool.ShotPool()
+        self.shot_sprites = shotpool.ShotSprites()
 
         # create Constructs
-        self.constrman = constrman.ConstrManager(path, self.shot_list)
-        self.constrman.load_constr('/resources/construct.png')
+        self.constrman = constrman.ConstrManager(path, self.shot_pool)
+        if self.bundle is not None:
+            self.constrman.load_constr_bundle(self.bundle, 'construct')
+        else:
+            self.constrman.load_constr('/resources/construct.png')
 
         # create Plates
         self.platesman = platesman.PlatesManager(path, self.constrman)
-        self.platesman.load_plates('/resources/plates64x64.png')
+        if self.bundle is not None:
+            self.platesman.load_plates_bundle(self.bundle, 'plates64x64')
+        else:
+            self.platesman.load_plates('/resources/plates64x64.png')
         #self.platesMan.printPlates()
         #self.platesman.generate()
         self.platesman.generate_empty()
+        # generate the upcoming lines of Plates in background
+        self.platesman.start_worker()
+        # time to first frame (without the first display)
+        self.load_report.total_time = time.perf_counter() - start
+
+        # Update phases, executed in this order every cycle (see update)
+        self.update_phases = [
+            ('BackTiles.tick', self.b_tiles.tick),
+            ('PlatesManager.tick', self.platesman.tick),
+            ('Ship.anim_tick', self.ship.anim_tick),
+            ('shot_list_tick', self.shot_list_tick),
+            ('ConstrManager.check_shots', self.constrman.check_shots),
+        ]
+
+        # the sprites are submitted to the render queue, blitted at once (flush)
+        self.render_queue = renderq.RenderQueue(self.surface)
+        layer = self.render_queue.layer
+        # only the changed regions are cleared and presented (see present.py)
+        self.presenter = present.Presenter(self.surface)
+
+        # Display layers, drawn in this order every cycle (see display)
+        self.display_layers = [
+            ('display.fill', self.display_fill),
+            ('display.BackTiles', lambda: self.b_tiles.display(layer(renderq.LAYER_BACK))),
+            ('display.PlatesManager', lambda: self.platesman.draw(layer(renderq.LAYER_PLATES))),
+            ('display.Ship', lambda: self.ship.draw(layer(renderq.LAYER_SHIP))),
+            ('display.flush', lambda: self.render_queue.flush(self.presenter.rects)),
+            ('display.shots', self.shot_list_display),
+            ('display.overlay', self.display_overlay),
+        ]
+
+        # Phases of a frame in their fixed order (the columns of the Frame Timer)
+        self.perf.add_phases(['input', 'Ship.move'] +
+            [name for name, _ in self.update_phases + self.display_layers] + ['flip'])
+
+    def display_fill(self):
+        """ Fill the surface (the regions changed in the last frame) with the background """
+        self.presenter.clear(self.background)
+
+    def display_overlay(self):
+        """ Draw the performance overlay """
+        rect = self.perf_overlay.draw(self.surface)
+        if rect is not None:
+            self.presenter.add(rect)
+
+    def present(self):
+        """ Present the drawn frame on the display """
+        self.presenter.present()
+        self.perf.lap('flip')
 
     def display(self):
         """ Draw scene on the surface. """
-        # display background
-        self.surface.fill(self.background)
-        self.b_tiles.display(self.surface)
-        self.platesman.draw(self.surface)
-        self.ship.draw(self.surface)
-        self.shot_list_display()
+        for name, layer in self.display_layers:
+            layer()
+            self.perf.lap(name)
+
+    def handle_key(self, key):
+        """ Process a KEYDOWN event """
+        if key == pygame.K_q:
+            self.ship.shoot(self.shot_pool)
+        elif key == pygame.K_0:
+            self.ship.set_weapon(0)
+        elif key == pygame.K_1:
+            self.ship.set_weapon(1)
+        elif key == pygame.K_2:
+            self.ship.set_weapon(2)
+        elif key == pygame.K_3:
+            self.ship.set_weapon(3)
+        elif key == pygame.K_4:
+            self.perf_overlay.toggle()
+            self.presenter.invalidate()
+        #if(not self.actList.execKeyDown(event.key, pygame.key.get_mods())):
+        #    pass
+
+    @staticmethod
+    def get_control():
+        """ Read the arrow keys and return the ship control bitmask """
+        control = 0
+        keys = pygame.key.get_pressed()
+        if keys[pygame.K_LEFT]:
+            control |= 1
+        if keys[pygame.K_RIGHT]:
+            control |= 2
+        if keys[pygame.K_UP]:
+            control |= 4
+        if keys[pygame.K_DOWN]:
+            control |= 8
+        return control
+
+    def update(self, control):
+        """ Move the ship and tick all the update phases (one cycle) """
+        self.ship.move(control)
+        self.perf.lap('Ship.move')
+        for name, phase in self.update_phases:
+            phase()
+            self.perf.lap(name)
 
     def run(self):
         """ Create a pygame surface until it is closed. """
         self.display()
-        pygame.display.flip()
+        self.present()
 
         # Initialize clock
         clock = pygame.time.Clock()
@@ -97,58 +230,47 @@ class PType:
             # ex: clock.tick(60) -> doesn't run faster than 60 frames/sec (16ms)
             clock.tick(60)
             #clock.tick(15)
+            self.perf.start_frame()
             self.quit_flag = check_for_quit()
             for event in pygame.event.get():
-
                 if event.type == pygame.KEYDOWN:
-                    if event.key == pygame.K_q:
-                        self.ship.shoot(self.shot_list)
-                    elif event.key == pygame.K_0:
-                        self.ship.set_weapon(0)
-                    elif event.key == pygame.K_1:
-                        self.ship.set_weapon(1)
-                    elif event.key == pygame.K_2:
-                        self.ship.set_weapon(2)
-                    elif event.key == pygame.K_3:
-                        self.ship.set_weapon(3)
-                    elif event.key == pygame.K_4:
-                        print(len(self.shot_list))
-                    #if(not self.actList.execKeyDown(event.key, pygame.key.get_mods())):
-                    #    pass
-
-            control = 0
-            keys = pygame.key.get_pressed()
-            if keys[pygame.K_LEFT]:
-                control |= 1
-            if keys[pygame.K_RIGHT]:
-                control |= 2
-            if keys[pygame.K_UP]:
-                control |= 4
-            if keys[pygame.K_DOWN]:
-                control |= 8
-
-            self.ship.move(control)
-
-            self.b_tiles.tick()
-            self.platesman.tick()
-            self.ship.anim_tick()
-            self.shot_list_tick()
-            self.constrman.check_shots()
+                    self.handle_key(event.key)
+                elif event.type in (pygame.VIDEOEXPOSE, pygame.WINDOWEXPOSED):
+                    # the content of the window was lost, present the whole surface
+                    self.presenter.invalidate()
+            control = self.get_control()
+            self.perf.lap('input')
+
+            self.update(control)
             self.display()
-            pygame.display.flip()
+            self.present()
+            self.perf.end_frame()
+
+        self.close()
+
+    def record_level(self, filename):
+        """ Record the level (lines of Plates, background) in file (see level.py) """
+        self.recorder = level.LevelRecorder(filename, self.platesman, self.b_tiles)
+
+    def play_level(self, filename):
+        """ Play a recorded level from file, instead of generating it (see level.py) """
+        level.LevelStream(filename).play(self.platesman, self.b_tiles)
+
+    def close(self):
+        """ Stop the generator threads, close the level recording and the frames CSV """
+        self.platesman.stop_worker()
+        self.perf.close_csv()
+        if self.recorder is not None:
+            self.recorder.close()
+            self.recorder = None
 
     def shot_list_display(self):
         """ Display schots """
-        for schot in self.shot_list:
-            pygame.draw.circle(self.surface, (255, 130, 0),
-                (schot.x_pos, schot.y_pos), schot.damage)
+        if self.shot_pool.count > 0:
+            # all shots at once, pre-rendered circles (see shotpool.ShotSprites)
+            self.presenter.add_rects(self.surface.blits(
+                self.shot_sprites.blit_list(self.shot_pool, (255, 130, 0))))
 
     def shot_list_tick(self):
         """ Ticks schots, to be called every cycle """
-        for schot in self.shot_list:
-            if (schot.y_pos > 0) and (schot.y_pos < self.height) and \
-                (schot.x_pos > 0) and (schot.y_pos < self.width):
-                schot.x_pos += schot.speed_x
-                schot.y_pos += schot.speed_y
-            else:
-                self.shot_list.remove(schot)
+        self.shot_pool.tick(self.width, self.height)
@@ -0,0 +1,115 @@
+# This file is part of the PType distribution.
+# Copyright (c) 2020 Igor Marinescu (igor.marinescu@gmail.com).
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#-------------------------------------------------------------------------------
+""" Random Streams Module. """
+#-------------------------------------------------------------------------------
+# Random Streams:
+# Every generator (subsystem) draws its random values from its own named
+# stream, so that the values drawn by one subsystem do not depend on the other
+# subsystems (ex. on the ticks or on the thread the subsystem runs in).
+# All streams are derived from one seed (numpy SeedSequence): the stream of a
+# name is always the same for the same seed.
+#
+#   seed --+-- SeedSequence(seed, name 'BackTiles')     --> RandStream
+#          +-- SeedSequence(seed, name 'PlatesManager') --> RandStream
+#          +-- ...
+#
+# A Random Stream pre-draws its uniform values in batches (RAND_BATCH) with
+# a numpy Generator, a draw (random, randint) only pops a pre-drawn value.
+# The numpy Generator of the stream is available (generator) for vectorized
+# draws. The state of a stream (get_state) can be restored (set_state): the
+# stream draws again the same values from there (ex. the values drawn for
+# lines generated in advance and discarded, see platesman.py).
+#
+# STREAMS is the process-wide instance, seeded (seed) before the subsystems
+# are created. Seeding again reseeds the streams already created in place
+# (the subsystems keep their stream objects).
+#-------------------------------------------------------------------------------
+
+import zlib
+
+import numpy as np
+
+# Number of values pre-drawn at once
+RAND_BATCH = 4096
+
+class RandStream:
+    """ Random Stream, uniform values pre-drawn in batches """
+
+    def __init__(self, seed=None, batch=RAND_BATCH):
+        """ seed - seed (int, SeedSequence or None = random seed)
+            batch - number of values pre-drawn at once """
+        self.generator = np.random.default_rng(seed)
+        self.batch = batch
+        self.values = []
+
+    def reseed(self, seed=None):
+        """ Start the stream again from seed (the pre-drawn values are discarded) """
+        self.generator = np.random.default_rng(seed)
+        self.values = []
+
+    def get_state(self):
+        """ Return the state of the stream (see set_state) """
+        return self.generator.bit_generator.state, list(self.values)
+
+    def set_state(self, state):
+        """ Restore a state of the stream (returned by get_state) """
+        self.generator.bit_generator.state = state[0]
+        self.values = list(state[1])
+
+    def random(self):
+        """ Return a uniform random float in [0, 1) """
+        if not self.values:
+            # pop() from the end
+            self.values = self.generator.random(self.batch)[::-1].tolist()
+        return self.values.pop()
+
+    def randint(self, low, high):
+        """ Return a uniform random int in [low, high] (including high, as random.randint) """
+        return low + int(self.random() * (high - low + 1))
+
+class RandStreams:
+    """ Named Random Streams derived from one seed """
+
+    def __init__(self, seed=None):
+        """ seed - int or None (random seed) """
+        self.seed_value = None
+        self.streams = {}
+        self.seed(seed)
+
+    def seed(self, seed=None):
+        """ Seed all streams again (also the streams already created), None = random
+            seed (see seed_value) """
+        if seed is None:
+            seed = np.random.SeedSequence().entropy
+        self.seed_value = seed
+        for name, stream in self.streams.items():
+            stream.reseed(self.seed_sequence(name))
+
+    def seed_sequence(self, name):
+        """ Return the SeedSequence of the stream of name """
+        return np.random.SeedSequence(self.seed_value,
+            spawn_key=(zlib.crc32(name.encode('utf-8')),))
+
+    def get(self, name):
+        """ Return the stream of name """
+        stream = self.streams.get(name)
+        if stream is None:
+            stream = RandStream(self.seed_sequence(name))
+            self.streams[name] = stream
+        return stream
+
+# Process-wide Random Streams
+STREAMS = RandStreams()
@@ -0,0 +1,97 @@
+# This file is part of the PType distribution.
+# Copyright (c) 2020 Igor Marinescu (igor.marinescu@gmail.com).
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#-------------------------------------------------------------------------------
+""" Render Queue Module. """
+#-------------------------------------------------------------------------------
+# Render Queue:
+# Instead of blitting on the display surface, the draw methods of the layers
+# (BackTiles.display, PlatesManager.draw, Ship.draw, Anim.draw through
+# ResourceManager.draw, ...) submit their blits to a Render Queue. The queue
+# keeps one list of entries (source, dest, area, special_flags) per layer and
+# is flushed once per frame: all layers in order (LAYER_BACK first), every
+# layer with one Surface.blits call.
+#
+#   display:  BackTiles  --blit-->  layer(LAYER_BACK)    [e, e]
+#             Plates     --blit-->  layer(LAYER_PLATES)  [e, e, e]  --flush-->  target.blits
+#             Ship       --blit-->  layer(LAYER_SHIP)    [e, e, e, e]
+#
+# A layer is submitted to through a Layer Queue, which has the blit method of
+# a surface, so the draw methods get it instead of the surface (unchanged).
+# Entries fully outside of the target (ex. the row of tiles drawn at y = -64)
+# are dropped (culled) when submitted.
+#-------------------------------------------------------------------------------
+
+# Layers, flushed in this order
+LAYER_BACK = 0
+LAYER_PLATES = 1
+LAYER_SHIP = 2
+LAYERS = 3
+
+class LayerQueue:
+    """ Layer Queue, collects the blits of one layer (used instead of a surface) """
+
+    def __init__(self, width, height):
+        """ width, height - size of the target surface (culling) """
+        self.width = width
+        self.height = height
+        self.entries = []        # (source, dest, area, special_flags)
+        self.culled = 0          # number of dropped entries
+
+    def blit(self, source, dest, area=None, special_flags=0):
+        """ Submit a blit (as Surface.blit), dropped if fully outside of the target """
+        x_pos, y_pos = dest
+        if area is None:
+            width, height = source.get_size()
+        else:
+            width, height = area[2], area[3]
+        if (x_pos >= self.width) or (y_pos >= self.height) or \
+                (x_pos + width <= 0) or (y_pos + height <= 0):
+            self.culled += 1
+            return
+        self.entries.append((source, dest, area, special_flags))
+
+    def get_size(self):
+        """ Size of the target surface """
+        return self.width, self.height
+
+class RenderQueue:
+    """ Render Queue, batched blits of all layers """
+
+    def __init__(self, target, layers=LAYERS):
+        """ target - surface the queue is flushed to
+            layers - number of layers """
+        self.target = target
+        width, height = target.get_size()
+        self.layers = [LayerQueue(width, height) for _ in range(layers)]
+
+    def layer(self, layer):
+        """ Return the Layer Queue of layer (has the blit method of a surface) """
+        return self.layers[layer]
+
+    def flush(self, dirty=None):
+        """ Blit all submitted entries, layer after layer, and empty the queue
+            dirty - list extended with the blitted rectangles (None = not required) """
+        blits = self.target.blits
+        for layer in self.layers:
+            if layer.entries:
+                if dirty is None:
+                    blits(layer.entries, doreturn=False)
+                else:
+                    dirty.extend(blits(layer.entries))
+                layer.entries = []
+
+    def culled(self):
+        """ Return the number of dropped entries (all layers) """
+        return sum(layer.culled for layer in self.layers)
@@ -14,23 +14,48 @@
 # along with this program. If not, see <http://www.gnu.org/licenses/>.
 #-------------------------------------------------------------------------------
 """ Resource Manager Module. """
+#-------------------------------------------------------------------------------
+# Asset Cache:
+# All loaded assets (converted images, lists of tiles, decoded plates) are kept
+# in one process-wide cache (ASSET_CACHE), shared by all Resource Managers.
+# The key of an asset is built from its full path and its colorkey options
+# (see image_key), so the same image is decoded and converted only once.
+#
+#   entries = OrderedDict( key -> [asset, ref_cnt] )
+#             |<- least recently used       most recently used ->|
+#
+# acquire() returns the asset (loaded on a miss) and increments its reference
+# counter, release() decrements it. Unused assets (ref_cnt = 0) stay in the
+# cache, only when there are more than max_unused of them the least recently
+# used are evicted.
+#-------------------------------------------------------------------------------
 
 import os.path
+import collections
+import time
+import functools
+import concurrent.futures
 import pygame
 
-def load_image(name, colorkey=None, colorkeypos=None):
-    """ Load image """
+def decode_image(name):
+    """ Decode image file (no conversion to display format) """
     fullname = os.path.join('', name)
     try:
-        img_surface = pygame.image.load(fullname)
+        return pygame.image.load(fullname)
     except pygame.error as message:
         print('Cannot load image:', fullname)
         raise SystemExit(message) from message
 
+def load_image(name, colorkey=None, colorkeypos=None, img_surface=None):
+    """ Load image
+        img_surface - already decoded image (see preload_images), if None decode it """
+    if img_surface is None:
+        img_surface = decode_image(name)
+
     img_surface = img_surface.convert()
 
     if colorkey is not None:
-        if colorkey is -1:
+        if colorkey == -1:
             colorkey = img_surface.get_at((0, 0))
         img_surface.set_colorkey(colorkey, pygame.RLEACCEL)
     elif colorkeypos is not None:
@@ -39,26 +64,189 @@ def load_image(name, colorkey=None, colorkeypos=None):
 
     return img_surface, img_surface.get_rect()
 
+def image_key(name, colorkey=None, colorkeypos=None):
+    """ Return the cache key of an image loaded with load_image """
+    # colorkey -1 is the color at position (0, 0)
+    if colorkey == -1:
+        colorkey = None
+        colorkeypos = (0, 0)
+    if colorkey is not None:
+        colorkey = tuple(colorkey)
+        colorkeypos = None
+    elif colorkeypos is not None:
+        colorkeypos = tuple(colorkeypos)
+    return ('image', os.path.normpath(name), colorkey, colorkeypos)
+
+class AssetCache:
+    """ Process-wide memoizing cache of assets, reference counted with LRU eviction """
+
+    def __init__(self, max_unused=16):
+        """ max_unused - maximal number of unused assets kept in the cache """
+        self.entries = collections.OrderedDict()
+        self.max_unused = max_unused
+        self.hits = 0
+        self.misses = 0
+
+    def acquire(self, key, loader):
+        """ Get the asset with key, call loader() to load it if not in the cache """
+        entry = self.entries.get(key)
+        if entry is None:
+            self.misses += 1
+            entry = [loader(), 0]
+            self.entries[key] = entry
+        else:
+            self.hits += 1
+            self.entries.move_to_end(key)
+        entry[1] += 1
+        return entry[0]
+
+    def release(self, key):
+        """ Release an asset acquired before """
+        entry = self.entries.get(key)
+        if entry is None:
+            return
+        entry[1] -= 1
+        self.entries.move_to_end(key)
+        self.evict()
+
+    def evict(self):
+        """ Evict the least recently used unused assets """
+        unused = [key for key, entry in self.entries.items() if entry[1] <= 0]
+        for key in unused[:max(0, len(unused) - self.max_unused)]:
+            del self.entries[key]
+
+    def clear(self):
+        """ Remove all assets """
+        self.entries.clear()
+
+ASSET_CACHE = AssetCache()
+
+def get_image(name, colorkey=None, colorkeypos=None):
+    """ Load image through the asset cache, the image must be released
+        with ASSET_CACHE.release(key). Returns (key, img_surface, img_rect) """
+    key = image_key(name, colorkey, colorkeypos)
+    img_surface, img_rect = ASSET_CACHE.acquire(key,
+        lambda: load_image(name, colorkey, colorkeypos))
+    return key, img_surface, img_rect
+
+class LoadReport:
+    """ Load times of the assets """
+
+    def __init__(self):
+        self.assets = []     # list of (name, decode_time, convert_time) in seconds
+        self.decode_time = 0.0
+        self.total_time = 0.0
+
+    def print(self):
+        """ Print the report """
+        print('{:<40}{:>12}{:>12}'.format('Asset', 'decode[ms]', 'convert[ms]'))
+        for name, decode_time, convert_time in self.assets:
+            print('{:<40}{:>12.2f}{:>12.2f}'.format(os.path.basename(name),
+                decode_time * 1000.0, convert_time * 1000.0))
+        print('Parallel decode: {:.2f}ms  Total load: {:.2f}ms'.format(
+            self.decode_time * 1000.0, self.total_time * 1000.0))
+
+def _timed_decode(name):
+    """ Decode image and measure the time (executed in a worker thread) """
+    start = time.perf_counter()
+    img_surface = decode_image(name)
+    return img_surface, time.perf_counter() - start
+
+def preload_images(images, workers=None):
+    """ Decode all images in a thread pool (SDL_image releases the GIL while
+        decoding), then convert them to display format on the main thread and
+        put them in the asset cache, where load_tiles/load_plates find them.
+        images - list of (name, colorkey, colorkeypos)
+        Returns a LoadReport """
+    report = LoadReport()
+    if workers is None:
+        workers = min(len(images), os.cpu_count() or 1)
+    start = time.perf_counter()
+    with concurrent.futures.ThreadPoolExecutor(max(workers, 1)) as executor:
+        decoded = list(executor.map(_timed_decode, [image[0] for image in images]))
+    report.decode_time = time.perf_counter() - start
+
+    for (name, colorkey, colorkeypos), (img_surface, decode_time) in zip(images, decoded):
+        time0 = time.perf_counter()
+        key = image_key(name, colorkey, colorkeypos)
+        ASSET_CACHE.acquire(key,
+            functools.partial(load_image, name, colorkey, colorkeypos, img_surface))
+        # keep it only as unused asset, until the first user acquires it
+        ASSET_CACHE.release(key)
+        report.assets.append((name, decode_time, time.perf_counter() - time0))
+    report.total_time = time.perf_counter() - start
+    return report
+
+def slice_tiles(name, res_def, colorkey = None, colorkeypos = None):
+    """ Return the list of tiles copied from the texture image """
+    img_key, img_text, _ = get_image(name, colorkey, colorkeypos)
+
+    # extract images from texture image based on resource definition (resDef)
+    tiles = []
+    for r_def in res_def:
+        src = r_def[0]
+        size = r_def[1]
+        surf = pygame.Surface(size)
+        surf.blit(img_text, (0, 0), (src[0], src[1], size[0], size[1]))
+        surf.set_colorkey((0, 0, 0))
+        tiles.append(surf)
+
+    ASSET_CACHE.release(img_key)
+    return tiles
+
+def slice_subsurface_tiles(name, res_def, colorkey = None, colorkeypos = None):
+    """ Return the list of tiles as subsurfaces of the texture image.
+        The tiles share the pixels and the colorkey of the texture image,
+        if no colorkey is given black (0, 0, 0) is used (as for copied tiles). """
+    img_key, img_text, img_rect = get_image(name, colorkey, colorkeypos)
+
+    # extract images from texture image based on resource definition (resDef)
+    tiles = []
+    for r_def in res_def:
+        # tiles partially outside of the texture image are clipped
+        rect = pygame.Rect(r_def[0], r_def[1]).clip(img_rect)
+        tiles.append(img_text.subsurface(rect))
+
+    ASSET_CACHE.release(img_key)
+    return tiles
+
 class ResourceManager:
     """ Resource Manager """
 
-    def __init__(self, path):
-        """ Init resource manager """
+    def __init__(self, path, subsurface=False):
+        """ Init resource manager
+            subsurface - tiles are subsurface views into the texture image
+                         (no pixels are copied) instead of new surfaces """
         self.img_list = []
         self.path = path
+        self.subsurface = subsurface
+        self.cache_keys = []     # keys of the assets acquired from ASSET_CACHE
 
     def load_tiles(self, filename, res_def, colorkey = None, colorkeypos = None):
-        """ Load all tiles in a list """
-        img_text, _ = load_image(self.path + filename, colorkey, colorkeypos)
-
-        # extract images from texture image based on resource definition (resDef)
-        for r_def in res_def:
-            src = r_def[0]
-            size = r_def[1]
-            surf = pygame.Surface(size)
-            surf.blit(img_text, (0, 0), (src[0], src[1], size[0], size[1]))
-            surf.set_colorkey((0, 0, 0))
-            self.img_list.append(surf)
+        """ Load all tiles in a list (shared with other Resource Managers) """
+        name = self.path + filename
+        if self.subsurface and (colorkey is None) and (colorkeypos is None):
+            colorkey = (0, 0, 0)
+        key = ('tiles', self.subsurface, tuple(res_def)) + image_key(name, colorkey, colorkeypos)
+        if self.subsurface:
+            tiles = ASSET_CACHE.acquire(key,
+                lambda: slice_subsurface_tiles(name, res_def, colorkey, colorkeypos))
+        else:
+            tiles = ASSET_CACHE.acquire(key,
+                lambda: slice_tiles(name, res_def, colorkey, colorkeypos))
+        self.cache_keys.append(key)
+        self.img_list.extend(tiles)
+
+    def load_bundle_tiles(self, bundle, name):
+        """ Load all tiles of entry name from an asset bundle (see bundle.py) """
+        self.img_list.extend(bundle.tiles(name))
+
+    def release(self):
+        """ Release all tiles (back to the asset cache) """
+        for key in self.cache_keys:
+            ASSET_CACHE.release(key)
+        self.cache_keys = []
+        self.img_list = []
 
     def draw(self, surface, index, x_pos, y_pos, area = None, special_flags = 0):
         """ Draw image """
@@ -15,20 +15,10 @@
 #-------------------------------------------------------------------------------
 """ Ship Module """
 import math
+import numpy as np
+import pygame
 from . import anim
 
-#-------------------------------------------------------------------------------
-class Shot:
-    """ Definition of a shot """
-
-    def __init__(self, x_pos, y_pos, speed_x, speed_y, damage):
-        """ Init Shot """
-        self.x_pos = x_pos
-        self.y_pos = y_pos
-        self.speed_x = speed_x
-        self.speed_y = speed_y
-        self.damage = damage
-
 #-------------------------------------------------------------------------------
 class Weap:
     """ Definition of a weapon """
@@ -38,10 +28,6 @@ class Weap:
         self.anim = anim_weap
         self.off_x = off_x
 
-    def tick(self):
-        """ Tick method,  must be called every cycle """
-        self.anim.tick()
-
     def draw(self, surface, x_pos, y_pos):
         """ Draw weapon """
         self.anim.draw(surface, x_pos + self.off_x[self.anim.frame_idx], y_pos)
@@ -51,7 +37,7 @@ class Weap:
             it depends how ship is tilt, left or right """
         return self.off_x[self.anim.frame_idx]
 
-    def shoot(self, shot_list, x_pos, y_pos):
+    def shoot(self, shot_pool, x_pos, y_pos):
         """ Weapon schot (virtual) """
 
 #-------------------------------------------------------------------------------
@@ -73,16 +59,19 @@ class Weap1(Weap):
         """ Init Weapon1 """
         self.weap_def = weap_def
         self.shot_def = weap_def[2]
+        # Shot definitions as arrays, all shots of the weapon are added at once
+        self.shot_off_x = np.array([shot[0][0] for shot in self.shot_def])
+        self.shot_off_y = np.array([shot[0][1] for shot in self.shot_def])
+        self.shot_speed_x = np.array([shot[1][0] for shot in self.shot_def])
+        self.shot_speed_y = np.array([shot[1][1] for shot in self.shot_def])
+        self.shot_damage = np.array([shot[2] for shot in self.shot_def])
         anim_weap = anim.AnimTiltLink(resman, weap_def[0], anim_ship)
         Weap.__init__(self, anim_weap, weap_def[1])
 
-    def shoot(self, shot_list, x_pos, y_pos):
+    def shoot(self, shot_pool, x_pos, y_pos):
         """ Weapon1 shoot """
-        for shoot in self.shot_def:
-            off_xy = shoot[0]
-            speed_xy = shoot[1]
-            shot_list.append(Shot(x_pos + self.get_off_x() + off_xy[0], y_pos + off_xy[1],
-                speed_xy[0], speed_xy[1], shoot[2]))
+        shot_pool.add(x_pos + self.get_off_x() + self.shot_off_x, y_pos + self.shot_off_y,
+            self.shot_speed_x, self.shot_speed_y, self.shot_damage)
 
 #-------------------------------------------------------------------------------
 class Ship:
@@ -96,12 +85,17 @@ class Ship:
         self.move_acc = 1    # move acceleratinq
         self.old_ctrl = 0    # old control (detect direction change)
 
-        self.anim_fire = anim.AnimCyc(res_man, [0, 1, 2, 3, 4, 5, 6, 7, 8], 3)
-        self.anim_ship = anim.AnimTilt(res_man, [18, 17, 16, 15, 14, 20, 21, 22, 23], 2)
+        # all animations of the ship, ticked at once (see anim_tick)
+        self.anims = anim.AnimationManager()
+        self.anim_fire = anim.AnimCyc(res_man, [0, 1, 2, 3, 4, 5, 6, 7, 8], 3, self.anims)
+        self.anim_ship = anim.AnimTilt(res_man, [18, 17, 16, 15, 14, 20, 21, 22, 23], 2,
+            self.anims)
 
         self.weapon_l = Weap1(res_man, self.anim_ship, WEAP_DEF_LIST[1])
         self.weapon_r = Weap1(res_man, self.anim_ship, WEAP_DEF_LIST[0])
         self.weapon = 0
+        # Composite of hull and weapons: {(tilt frame, weapon): (surface, offset x)}
+        self.composite = {}
 
         self.sphere_a = 0
         self.sphere_x = 0
@@ -109,10 +103,8 @@ class Ship:
 
     def anim_tick(self):
         """ Animation tick """
-        self.anim_fire.tick()
-        self.anim_ship.tick()
-        self.weapon_r.tick()
-        self.weapon_l.tick()
+        # fire, ship and the weapons (linked to the ship)
+        self.anims.tick()
 
         self.sphere_a += 0.05
         self.sphere_x = 16 + int(64.0 * math.cos(self.sphere_a))
@@ -144,41 +136,69 @@ class Ship:
             if self.y_pos < 1000:
                 self.y_pos += self.move_acc
 
-    def draw(self, surface):
-        """ Draw Ship, Weapons and Fire """
+    def render_composite(self, frame_idx, weapon):
+        """ Composite hull and weapons of tilt frame frame_idx in one surface,
+            returns (surface, offset x of the surface relative to the ship) """
+        img_list = self.resman.img_list
+        hull = [(img_list[self.anim_ship.frame_lst[frame_idx]], 0)]
+        weap_l = []
+        if weapon & 1:
+            weap_l = [(img_list[self.weapon_l.anim.frame_lst[frame_idx]],
+                self.weapon_l.off_x[frame_idx])]
+        weap_r = []
+        if weapon & 2:
+            weap_r = [(img_list[self.weapon_r.anim.frame_lst[frame_idx]],
+                self.weapon_r.off_x[frame_idx])]
         # The order of displaying the ship and weapons is important
         # Tilt to Right?
-        if self.anim_ship.frame_idx <= self.anim_ship.ini_idx:
-            if self.weapon & 1:
-                self.weapon_l.draw(surface, self.x_pos, self.y_pos)
-            self.anim_ship.draw(surface, self.x_pos, self.y_pos)
-            if self.weapon & 2:
-                self.weapon_r.draw(surface, self.x_pos, self.y_pos)
+        if frame_idx <= self.anim_ship.ini_idx:
+            parts = weap_l + hull + weap_r
         # Tilt to Left?
         else:
-            if self.weapon & 2:
-                self.weapon_r.draw(surface, self.x_pos, self.y_pos)
-            self.anim_ship.draw(surface, self.x_pos, self.y_pos)
-            if self.weapon & 1:
-                self.weapon_l.draw(surface, self.x_pos, self.y_pos)
+            parts = weap_r + hull + weap_l
+
+        x_min = min(off_x for _, off_x in parts)
+        x_max = max(off_x + img.get_width() for img, off_x in parts)
+        height = max(img.get_height() for img, _ in parts)
+        # transparent color of the tiles (no opaque pixel has it)
+        colorkey = hull[0][0].get_colorkey() or (0, 0, 0)
+        surf = pygame.Surface((x_max - x_min, height))
+        surf.fill(colorkey)
+        for img, off_x in parts:
+            surf.blit(img, (off_x - x_min, 0))
+        # never changed, RLE for a faster blit
+        surf.set_colorkey(colorkey, pygame.RLEACCEL)
+        return surf, x_min
+
+    def draw(self, surface):
+        """ Draw Ship, Weapons and Fire """
+        # Hull and weapons (one blit, composite cached per tilt frame)
+        key = (self.anim_ship.frame_idx, self.weapon)
+        comp = self.composite.get(key)
+        if comp is None:
+            comp = self.render_composite(*key)
+            self.composite[key] = comp
+        surface.blit(comp[0], (self.x_pos + comp[1], self.y_pos))
         # Fire
         self.anim_fire.draw(surface, self.x_pos + 16, self.y_pos + 64)
         self.resman.draw(surface, 9, self.x_pos + self.sphere_x, self.y_pos + self.sphere_y)
 
     def set_weapon(self, weapon):
-        """ Set weapon """
+        """ Set weapon (the composites of the other weapons are discarded) """
+        if weapon != self.weapon:
+            self.composite = {}
         self.weapon = weapon
 
-    def shoot(self, shot_list):
-        """ Add shoot to shot-list """
+    def shoot(self, shot_pool):
+        """ Add shoot to shot-pool (main, weapons, sphere: the order the shots hit in) """
         # add main (ship) shot
-        shot_list.append(Shot(self.x_pos + 32, self.y_pos, 0, -4, damage = 4))
+        shot_pool.add(self.x_pos + 32, self.y_pos, 0, -4, 4)
         # add weapon 1 shot
         if self.weapon & 1:
-            self.weapon_l.shoot(shot_list, self.x_pos, self.y_pos)
+            self.weapon_l.shoot(shot_pool, self.x_pos, self.y_pos)
         # add weapon 2 shot
         if self.weapon & 2:
-            self.weapon_r.shoot(shot_list, self.x_pos, self.y_pos)
+            self.weapon_r.shoot(shot_pool, self.x_pos, self.y_pos)
         # add sphere schoot
-        shot_list.append(Shot(self.x_pos + self.sphere_x + 16,
-            self.y_pos + self.sphere_y + 16, 0, -5, damage = 2))
+        shot_pool.add(self.x_pos + self.sphere_x + 16, self.y_pos + self.sphere_y + 16,
+            0, -5, 2)
@@ -0,0 +1,154 @@
+# This file is part of the PType distribution.
+# Copyright (c) 2020 Igor Marinescu (igor.marinescu@gmail.com).
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#-------------------------------------------------------------------------------
+""" Shot Pool Module. """
+#-------------------------------------------------------------------------------
+# All shots are stored in a Shot Pool as a struct of arrays.
+# Every shot is an index in the parallel arrays:
+#
+#             |  0  |  1  |  2  | ... | count-1 | ... | capacity-1 |
+#   x_pos     |     |     |     |     |         |     |            |
+#   y_pos     |     |     |     |     |         |     |            |
+#   speed_x   |     |     |     |     |         |     |            |
+#   speed_y   |     |     |     |     |         |     |            |
+#   damage    |     |     |     |     |         |     |            |
+#   alive     |     |     |     |     |         |     |            |
+#             |<------- used shots ------>|<------ free ------>|
+#
+# Shots are appended in bulk at the end (add). A hit shot is only marked as
+# not alive (kill), the dead and the off-screen shots are removed all at once
+# by compacting the arrays (compact, tick).
+#-------------------------------------------------------------------------------
+# Shot Sprites:
+# A shot is a filled circle, the radius is its damage. Instead of drawing every
+# circle (pygame.draw.circle), a sprite of the circle is rendered once for every
+# (radius, color) and all shots are drawn with one Surface.blits call. The
+# circle is drawn on the sprite at (radius, radius), the sprite is blitted at
+# (x - radius, y - radius): the same pixels as the circle drawn at (x, y).
+#-------------------------------------------------------------------------------
+
+import numpy as np
+import pygame
+
+SHOT_DTYPE = np.int32
+
+class ShotPool:
+    """ Shot Pool, struct of arrays """
+
+    def __init__(self, capacity=256):
+        """ Init Shot Pool with an initial capacity (grows if required) """
+        self.count = 0
+        self.x_pos = np.zeros(capacity, SHOT_DTYPE)
+        self.y_pos = np.zeros(capacity, SHOT_DTYPE)
+        self.speed_x = np.zeros(capacity, SHOT_DTYPE)
+        self.speed_y = np.zeros(capacity, SHOT_DTYPE)
+        self.damage = np.zeros(capacity, SHOT_DTYPE)
+        self.alive = np.zeros(capacity, bool)
+
+    def __len__(self):
+        return self.count
+
+    def _arrays(self):
+        """ Return all the parallel arrays """
+        return (self.x_pos, self.y_pos, self.speed_x, self.speed_y, self.damage, self.alive)
+
+    def _reserve(self, size):
+        """ Grow arrays (double capacity) until size shots fit in """
+        capacity = len(self.x_pos)
+        if size <= capacity:
+            return
+        # an empty pool (capacity 0) grows from 1
+        capacity = max(capacity, 1)
+        while capacity < size:
+            capacity *= 2
+        (self.x_pos, self.y_pos, self.speed_x, self.speed_y, self.damage, self.alive) = [
+            np.resize(arr, capacity) for arr in self._arrays()]
+
+    def add(self, x_pos, y_pos, speed_x, speed_y, damage):
+        """ Append shots in bulk. Every argument is a scalar or an array,
+            the scalars are broadcasted to the length of the arrays """
+        x_pos, y_pos, speed_x, speed_y, damage = np.broadcast_arrays(
+            x_pos, y_pos, speed_x, speed_y, damage)
+        cnt = x_pos.size
+        start = self.count
+        end = start + cnt
+        self._reserve(end)
+        self.x_pos[start:end] = x_pos.ravel()
+        self.y_pos[start:end] = y_pos.ravel()
+        self.speed_x[start:end] = speed_x.ravel()
+        self.speed_y[start:end] = speed_y.ravel()
+        self.damage[start:end] = damage.ravel()
+        self.alive[start:end] = True
+        self.count = end
+
+    def kill(self, idx):
+        """ Mark shot(s) as not alive, removed by next compact """
+        self.alive[idx] = False
+
+    def compact(self, keep=None):
+        """ Remove all not alive shots (or all shots not in keep mask) """
+        cnt = self.count
+        if keep is None:
+            keep = self.alive[:cnt]
+        new_cnt = int(np.count_nonzero(keep))
+        if new_cnt == cnt:
+            return
+        for arr in self._arrays():
+            arr[:new_cnt] = arr[:cnt][keep]
+        self.count = new_cnt
+
+    def clear(self):
+        """ Remove all shots """
+        self.count = 0
+
+    def tick(self, width, height):
+        """ Move all shots inside of (width, height) and remove the rest """
+        cnt = self.count
+        if cnt == 0:
+            return
+        x_pos = self.x_pos[:cnt]
+        y_pos = self.y_pos[:cnt]
+        keep = self.alive[:cnt] & (x_pos > 0) & (x_pos < width) & (y_pos > 0) & (y_pos < height)
+        x_pos += self.speed_x[:cnt]
+        y_pos += self.speed_y[:cnt]
+        self.compact(keep)
+
+class ShotSprites:
+    """ Shot Sprites, pre-rendered circles for every (radius, color) """
+
+    def __init__(self):
+        self.sprites = {}        # {(radius, color): surface}
+
+    def sprite(self, radius, color):
+        """ Return the sprite of the circle (radius, color), rendered once """
+        key = (radius, color)
+        surf = self.sprites.get(key)
+        if surf is None:
+            size = (2 * max(radius, 0)) + 2
+            surf = pygame.Surface((size, size))
+            # black is transparent, RLE for a faster blit
+            surf.fill((0, 0, 0))
+            pygame.draw.circle(surf, color, (radius, radius), radius)
+            surf.set_colorkey((0, 0, 0), pygame.RLEACCEL)
+            self.sprites[key] = surf
+        return surf
+
+    def blit_list(self, pool, color):
+        """ Return the list of (sprite, position) of all shots of pool (for Surface.blits) """
+        cnt = pool.count
+        radius = pool.damage[:cnt]
+        sprites = {rad: self.sprite(rad, color) for rad in np.unique(radius).tolist()}
+        return list(zip([sprites[rad] for rad in radius.tolist()],
+            zip((pool.x_pos[:cnt] - radius).tolist(), (pool.y_pos[:cnt] - radius).tolist())))
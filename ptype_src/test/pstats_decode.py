@@ -1,8 +1,60 @@
-""" pstats Time extended function """
+""" pstats Time extended function
 
+Profiling of a fixed headless scenario (the benchmark, see bench.py):
+capture the profile of a number of ticks, show it and compare two captured
+profiles per function (time per tick, calls per tick, regressions).
+
+Execute with:
+$ python -m ptype_src.test.pstats_decode capture --ticks 2000 --out base.prof
+$ python -m ptype_src.test.pstats_decode show base.prof --filter backtiles
+$ python -m ptype_src.test.pstats_decode diff base.prof new.prof --threshold 10
+"""
+#-------------------------------------------------------------------------------
+# Captured profile (the scenario is profiled repeat times, same seed):
+#   <out>       - pstats file of the first run (cProfile of Bench.run_ticks,
+#                 without the loading and closing of the game), shown by show
+#   <out>.<n>   - pstats files of the next runs (n = 1 .. repeat - 1)
+#   <out>.json  - metadata: ticks, seed, repeat, commit, versions, date,
+#                 total time (median of the runs)
+#
+# The diff compares the functions by (file name, function name), the line
+# numbers are ignored (they change between two versions of a file). All times
+# are divided by the number of ticks of the profile, so profiles of different
+# lengths can be compared, and every value is the median of the runs of the
+# profile (a single run has a noise of several us per tick in the functions
+# which blit or wait for the Plates Worker). A function is a regression if its
+# time per tick increased by more than threshold % and by more than min_us
+# microseconds (the noise floor, relative and absolute); diff exits with 1 if
+# there is any regression (performance gate).
+#-------------------------------------------------------------------------------
+
+import os
+import sys
+import json
+import time
+import statistics
 import pstats
+import platform
+import argparse
+import cProfile
+import subprocess
 from pstats import SortKey
 
+import pygame
+
+from .. import bench
+from .. import randstream
+
+# Default seed of the profiled scenario
+SEED = 1
+
+# Default number of runs of a captured profile (see capture)
+REPEAT = 5
+
+# Default regression thresholds (see diff)
+THRESHOLD = 10.0
+MIN_US = 5.0
+
 def f_8(val):
     """ Modify time to show in us precision. """
     ret = "%8.3f" % val
@@ -12,7 +64,162 @@ def f_8(val):
 
 pstats.f8 = f_8
 
-p = pstats.Stats('profile.out')
+def git_commit(path):
+    """ Return the current git commit of path (None if not available) """
+    try:
+        out = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=path,
+            capture_output=True, text=True, check=True)
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return out.stdout.strip()
+
+def run_file(prof_file, idx):
+    """ Return the pstats file of run idx of a captured profile """
+    return prof_file if idx == 0 else '{}.{}'.format(prof_file, idx)
+
+def capture(out_file, ticks, seed, repeat):
+    """ Profile ticks ticks of the benchmark repeat times, save the stats of every
+        run (see run_file) and the metadata in out_file.json """
+    path = os.path.dirname(os.path.dirname(os.path.realpath(os.path.abspath(__file__))))
+    total_times = []
+    for idx in range(repeat):
+        randstream.STREAMS.seed(seed)
+        module = bench.Bench(600, 600, path, ticks)
+        profiler = cProfile.Profile()
+        start = time.perf_counter()
+        profiler.runcall(module.run_ticks)
+        total_times.append(time.perf_counter() - start)
+        # the Plates Worker is joined on close, outside of the profile
+        module.game.close()
+        module.report()
+        profiler.dump_stats(run_file(out_file, idx))
+    total_time = statistics.median(total_times)
+    meta = {'ticks': ticks,
+            'seed': seed,
+            'repeat': repeat,
+            'commit': git_commit(path),
+            'python': platform.python_version(),
+            'pygame': pygame.version.ver,
+            'platform': platform.platform(),
+            'date': time.strftime('%Y-%m-%d %H:%M:%S'),
+            'total_time': total_time}
+    with open(out_file + '.json', 'w') as file:
+        json.dump(meta, file, indent=2)
+    print('Profile written: {} ({} ticks, {} runs, median {:.3f}s)'.format(out_file, ticks,
+        repeat, total_time))
+
+def load_meta(prof_file):
+    """ Return the metadata of a captured profile ({} if not available) """
+    try:
+        with open(prof_file + '.json', 'r') as file:
+            return json.load(file)
+    except OSError:
+        return {}
+
+def show(prof_file, sort, limit, filt):
+    """ Print a captured profile """
+    meta = load_meta(prof_file)
+    if meta:
+        print(json.dumps(meta))
+    stats = pstats.Stats(prof_file)
+    sort_key = SortKey.TIME if sort == 'tottime' else SortKey.CUMULATIVE
+    restrictions = [filt] if filt else []
+    stats.strip_dirs().sort_stats(sort_key).print_stats(*(restrictions + [limit]))
+
+def run_stats(prof_file, ticks):
+    """ Return {(file, function): [calls, tottime, cumtime] per tick} of a pstats file """
+    funcs = {}
+    for (filename, _, name), (_, ncalls, tottime, cumtime, _) in \
+            pstats.Stats(prof_file).stats.items():
+        key = (os.path.basename(filename), name)
+        val = funcs.setdefault(key, [0.0, 0.0, 0.0])
+        val[0] += ncalls / ticks
+        val[1] += tottime / ticks
+        val[2] += cumtime / ticks
+    return funcs
+
+def func_stats(prof_file):
+    """ Return {(file, function): [calls, tottime, cumtime] per tick} (median of the
+        runs of the profile), the ticks and the number of runs """
+    meta = load_meta(prof_file)
+    ticks = max(1, meta.get('ticks', 1))
+    runs = [run_stats(run_file(prof_file, idx), ticks) for idx in range(meta.get('repeat', 1))]
+    zero = [0.0, 0.0, 0.0]
+    funcs = {}
+    for key in set().union(*runs):
+        values = [run.get(key, zero) for run in runs]
+        funcs[key] = [statistics.median(val[col] for val in values) for col in range(3)]
+    return funcs, ticks, len(runs)
+
+def diff(old_file, new_file, sort, limit, threshold, min_us):
+    """ Compare two captured profiles per function, returns the number of regressions """
+    old, old_ticks, old_runs = func_stats(old_file)
+    new, new_ticks, new_runs = func_stats(new_file)
+    col = 1 if sort == 'tottime' else 2
+    zero = [0.0, 0.0, 0.0]
+    print('old: {} ({} ticks, {} runs, commit {})'.format(old_file, old_ticks, old_runs,
+        load_meta(old_file).get('commit')))
+    print('new: {} ({} ticks, {} runs, commit {})'.format(new_file, new_ticks, new_runs,
+        load_meta(new_file).get('commit')))
+    print('{} per tick [us] (median of the runs), calls per tick'.format(sort))
+    print('{:<48}{:>10}{:>10}{:>9}{:>10}{:>10}'.format('function', 'old', 'new', 'delta%',
+        'calls old', 'calls new'))
+
+    rows = []
+    for key in set(old) | set(new):
+        old_val = old.get(key, zero)
+        new_val = new.get(key, zero)
+        delta = (new_val[col] - old_val[col]) * 1e6
+        percent = (delta * 100.0 / (old_val[col] * 1e6)) if old_val[col] > 0 else float('inf')
+        regression = (percent > threshold) and (delta > min_us)
+        rows.append((delta, percent, regression, key, old_val, new_val))
+    # the largest changes (increase and decrease) first
+    rows.sort(key=lambda row: -abs(row[0]))
+
+    for _, percent, regression, key, old_val, new_val in rows[:limit]:
+        # built-in functions have no file ('~')
+        name = key[1] if key[0] == '~' else '{}:{}'.format(*key)
+        print('{:<48}{:>10.1f}{:>10.1f}{:>9.1f}{:>10.2f}{:>10.2f}{}'.format(name[-47:],
+            old_val[col] * 1e6, new_val[col] * 1e6, percent, old_val[0], new_val[0],
+            '  REGRESSION' if regression else ''))
+    regressions = sum(row[2] for row in rows)
+    print('Regressions (> {}% and > {}us per tick): {}'.format(threshold, min_us, regressions))
+    return regressions
+
+def main(argv=None):
+    """ Capture, show or compare profiles """
+    parser = argparse.ArgumentParser(prog='ptype_src.test.pstats_decode',
+        description='Profile the PType benchmark and compare profiles')
+    sub = parser.add_subparsers(dest='cmd', required=True)
+    cap = sub.add_parser('capture', help='profile the benchmark')
+    cap.add_argument('--ticks', type=int, default=2000, help='number of ticks')
+    cap.add_argument('--seed', type=int, default=SEED, help='seed of the level')
+    cap.add_argument('--repeat', type=int, default=REPEAT,
+        help='number of runs (diff compares their median)')
+    cap.add_argument('--out', default='profile.out', help='profile file')
+    shw = sub.add_parser('show', help='print a profile')
+    shw.add_argument('prof', nargs='?', default='profile.out', help='profile file')
+    shw.add_argument('--filter', default=None, help='only functions matching (regex)')
+    dif = sub.add_parser('diff', help='compare two profiles')
+    dif.add_argument('old', help='old (reference) profile file')
+    dif.add_argument('new', help='new profile file')
+    dif.add_argument('--threshold', type=float, default=THRESHOLD,
+        help='regression threshold in percent')
+    dif.add_argument('--min-us', type=float, default=MIN_US,
+        help='ignore changes below this time per tick')
+    for sub_parser in (shw, dif):
+        sub_parser.add_argument('--sort', choices=('tottime', 'cumtime'), default='tottime')
+        sub_parser.add_argument('--limit', type=int, default=30, help='number of functions')
+    args = parser.parse_args(argv)
+
+    if args.cmd == 'capture':
+        capture(args.out, args.ticks, args.seed, max(1, args.repeat))
+    elif args.cmd == 'show':
+        show(args.prof, args.sort, args.limit, args.filter)
+    else:
+        if diff(args.old, args.new, args.sort, args.limit, args.threshold, args.min_us) > 0:
+            return 1
+    return 0
 
-#p.strip_dirs().sort_stats(SortKey.NAME).print_stats()
-p.strip_dirs().sort_stats(SortKey.FILENAME).print_stats('backtiles')
+if __name__ == '__main__':
+    sys.exit(main())
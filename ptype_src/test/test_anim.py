@@ -40,11 +40,12 @@ class TestAnim:
         self.resman.load_tiles("/resources/construct.png", res_def_constrman.resDef, colorkey = -1)
 
         # create animation
-        self.anim1 = anim.AnimCyc(self.resman, [0,1,2,3,4,5,6,7,8], 5)
-        self.anim2 = anim.AnimCyc(self.resman, [9, 10, 11, 12, 13, 14], 5)
-        self.anim3 = anim.AnimCyc(self.resman, range(15, 23), 5)
-        self.anim4 = anim.AnimCyc(self.resman, range(23, 31), 5)
-        self.anim5 = anim.AnimCyc(self.resman, range(31, 39), 5)
+        self.anims = anim.AnimationManager()
+        self.anim1 = anim.AnimCyc(self.resman, [0,1,2,3,4,5,6,7,8], 5, self.anims)
+        self.anim2 = anim.AnimCyc(self.resman, [9, 10, 11, 12, 13, 14], 5, self.anims)
+        self.anim3 = anim.AnimCyc(self.resman, range(15, 23), 5, self.anims)
+        self.anim4 = anim.AnimCyc(self.resman, range(23, 31), 5, self.anims)
+        self.anim5 = anim.AnimCyc(self.resman, range(31, 39), 5, self.anims)
 
     def display(self):
         """ Draw scene on the surface. """
@@ -88,10 +89,6 @@ class TestAnim:
                     elif event.key == pygame.K_3:
                         pass
 
-            self.anim1.tick()
-            self.anim2.tick()
-            self.anim3.tick()
-            self.anim4.tick()
-            self.anim5.tick()
+            self.anims.tick()
             self.display()
             pygame.display.flip()
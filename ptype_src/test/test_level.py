@@ -0,0 +1,72 @@
+# This file is part of the PType distribution.
+# Copyright (c) 2020 Igor Marinescu (igor.marinescu@gmail.com).
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#-------------------------------------------------------------------------------
+""" Test Level Module.
+
+Headless round trip of a recorded level: a level is recorded, then played
+and recorded again for the same number of ticks (as --play X --record Y),
+both files must be identical.
+
+Execute with:
+$ python -m ptype_src.test.test_level
+"""
+
+import os
+import sys
+import tempfile
+
+# Must be set before the display is initialized
+os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+
+from .. import ptype # pylint: disable=wrong-import-position
+
+# Number of ticks recorded (blocks of Back Tiles are swapped every 3200 ticks)
+TICKS = 4000
+
+def run_level(path, ticks, play=None, record=None):
+    """ Run the game headless for ticks ticks, playing and / or recording a level """
+    game = ptype.PType(600, 600, path)
+    if play is not None:
+        game.play_level(play)
+    if record is not None:
+        game.record_level(record)
+    for _ in range(ticks):
+        game.update(0)
+    game.close()
+
+def round_trip(ticks=TICKS):
+    """ Record a level, play and record it again, returns the data of both files """
+    path = os.path.dirname(os.path.dirname(os.path.realpath(os.path.abspath(__file__))))
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        first = os.path.join(tmp_dir, 'first.lvl')
+        second = os.path.join(tmp_dir, 'second.lvl')
+        run_level(path, ticks, record=first)
+        run_level(path, ticks, play=first, record=second)
+        with open(first, 'rb') as file:
+            first_data = file.read()
+        with open(second, 'rb') as file:
+            second_data = file.read()
+    return first_data, second_data
+
+def test_play_record_round_trip():
+    """ A played and recorded again level is identical to the played level """
+    first_data, second_data = round_trip()
+    assert first_data == second_data, 'Level recorded again differs from the played level'
+
+if __name__ == '__main__':
+    FIRST, SECOND = round_trip()
+    assert FIRST == SECOND, 'Level recorded again differs from the played level'
+    print('Round trip ok: {} bytes'.format(len(FIRST)))
+    sys.exit(0)
@@ -20,6 +20,7 @@ import pygame
 from .. import ptype
 from .. import platesman
 from .. import constrman
+from .. import shotpool
 
 # ###############################################################################
 # Main
@@ -35,9 +36,9 @@ class TestPlates:
         pygame.display.set_caption('Test')
         self.back_color = (10,10,50)
         self.quit_flag = False
-        self.shot_list = []
+        self.shot_pool = shotpool.ShotPool()
 
-        self.constrman = constrman.ConstrManager(path, self.shot_list)
+        self.constrman = constrman.ConstrManager(path, self.shot_pool)
         self.constrman.load_constr('/resources/plates64x64.png')
 
         self.platesman = platesman.PlatesManager(path, self.constrman)
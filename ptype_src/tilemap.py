@@ -0,0 +1,79 @@
+# This file is part of the PType distribution.
+# Copyright (c) 2020 Igor Marinescu (igor.marinescu@gmail.com).
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#-------------------------------------------------------------------------------
+""" Tile Map Module. """
+#-------------------------------------------------------------------------------
+# Tile Map:
+# A Tile Map is a [rows x cols] map of cells, used for all the scrolling maps
+# (background Tiles, Plates). The cells are stored in one flat list, row after
+# row, and the rows build a ring buffer. 'head' is the position in the ring of
+# the (logical) row 0:
+#
+#   cells = [ ring row 0  | ring row 1  | ... | ring row (rows - 1) ]
+#             |<- cols ->|
+#
+#   logical row y is stored at ring row (head + y) % rows
+#
+# Scrolling all rows one row down only moves the head one row back (O(1)):
+# the last row becomes row 0, its old content is to be overwritten in place
+# by the new generated row.
+#
+#   before scroll:        after scroll:
+#     row 0 = A             row 0 = C  (old last row, to be overwritten)
+#     row 1 = B             row 1 = A
+#     row 2 = C             row 2 = B
+#-------------------------------------------------------------------------------
+
+class TileMap:
+    """ Tile Map, rows stored in a ring buffer """
+
+    def __init__(self, rows, cols, value=None):
+        """ rows, cols - size of the map
+            value - initial value of all cells """
+        self.rows = rows
+        self.cols = cols
+        self.head = 0
+        self.cells = [value] * (rows * cols)
+
+    def row_offset(self, row):
+        """ Return the index in cells of the first cell of (logical) row """
+        return ((self.head + row) % self.rows) * self.cols
+
+    def get(self, row, col):
+        """ Get value of cell """
+        return self.cells[(((self.head + row) % self.rows) * self.cols) + col]
+
+    def set(self, row, col, value):
+        """ Set value of cell """
+        self.cells[(((self.head + row) % self.rows) * self.cols) + col] = value
+
+    def get_row(self, row):
+        """ Return a copy (list) of all cells of row """
+        offset = self.row_offset(row)
+        return self.cells[offset:offset + self.cols]
+
+    def set_row(self, row, values):
+        """ Set all cells of row from a list of cols values """
+        offset = self.row_offset(row)
+        self.cells[offset:offset + self.cols] = values
+
+    def fill(self, value):
+        """ Set all cells to value """
+        self.head = 0
+        self.cells[:] = [value] * (self.rows * self.cols)
+
+    def scroll(self):
+        """ Scroll all rows one row down, the last row becomes row 0 """
+        self.head = (self.head - 1) % self.rows